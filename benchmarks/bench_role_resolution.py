@@ -0,0 +1,128 @@
+"""
+Compares resolving the authorizations of accounts returned by
+`get_accounts_by_role`, before and after resolution moved to the role
+snapshot.
+
+The legacy path decodes `$lookup` output, with every role document
+embedded in every account, and merges it account by account. The snapshot
+path decodes plain account documents and resolves each one with
+`RoleCache.resolve`. Both timings include BSON decoding, which is the part
+of the driver's work that the `$lookup` inflates.
+
+Run with `python -m benchmarks.bench_role_resolution`.
+"""
+
+import gc
+import json
+import random
+import time
+from copy import deepcopy
+import bson
+from util.db import RoleCache
+
+ROLE_COUNT = 20
+ACCOUNT_COUNTS = [10_000, 100_000]
+
+
+class SnapshotCollection:
+    """Serves role documents to a RoleCache."""
+
+    def __init__(self, roles):
+        self.roles = roles
+
+    def find(self, *_, **__):
+        return deepcopy(self.roles)
+
+
+def make_roles() -> list[dict]:
+    """Builds role documents with ten permissions and five readable and writable roles each."""
+    names = [f'role{number}' for number in range(ROLE_COUNT)]
+    return [{
+        'name': name,
+        'authorizations': {
+            **{f'{name}_permission{number}': True for number in range(10)},
+            '_read': random.sample(names, 5),
+            '_write': random.sample(names, 5)
+        }
+    } for name in names]
+
+
+def make_accounts(count: int, roles: list[dict]) -> list[dict]:
+    """Builds accounts drawn from fifty combinations of one to four roles."""
+    names = [role['name'] for role in roles]
+    combinations = [random.sample(names, random.randint(1, 4)) for _ in range(50)]
+    return [{'email': f'user{number}@university.edu',
+             'roles': random.choice(combinations)}
+            for number in range(count)]
+
+
+def legacy_resolve(account_data: list[dict]) -> list[dict]:
+    """The merge that ran over `$lookup` output before the role snapshot."""
+    transformed_account_data = []
+    for data in account_data:
+        authorizations = {}
+        read_roles = []
+        write_roles = []
+        for auth in data['authorizations']:
+            data_read_roles = auth.get('authorizations', {}).get('_read', [])
+            data_write_roles = auth.get('authorizations', {}).get('_write', [])
+            auth['authorizations'].pop('_read')
+            auth['authorizations'].pop('_write')
+            authorizations.update(auth.get('authorizations', {}))
+            read_roles = read_roles + data_read_roles
+            write_roles = write_roles + data_write_roles
+
+        authorizations['_read'] = read_roles
+        authorizations['_write'] = write_roles
+        data['authorizations'] = authorizations
+        transformed_account_data.append(data)
+    return transformed_account_data
+
+
+def snapshot_resolve(role_cache: RoleCache, account_data: list[dict]) -> list[dict]:
+    """The merge that runs over plain account documents with the role snapshot."""
+    transformed_account_data = []
+    for data in account_data:
+        data['authorizations'] = role_cache.resolve(data.get('roles', []))
+        transformed_account_data.append(data)
+    return transformed_account_data
+
+
+def main():
+    random.seed(0)
+    roles = make_roles()
+    roles_by_name = {role['name']: role for role in roles}
+    role_cache = RoleCache(SnapshotCollection(roles))
+    role_cache.load()
+
+    results = []
+    for count in ACCOUNT_COUNTS:
+        accounts = make_accounts(count, roles)
+        lookup_output = [bson.encode({**account,
+                                      'authorizations': [roles_by_name[name]
+                                                         for name in account['roles']]})
+                         for account in accounts]
+        account_output = [bson.encode(account) for account in accounts]
+
+        gc.collect()
+        start = time.perf_counter()
+        legacy_resolve([bson.decode(data) for data in lookup_output])
+        legacy_seconds = time.perf_counter() - start
+
+        gc.collect()
+        start = time.perf_counter()
+        snapshot_resolve(role_cache, [bson.decode(data) for data in account_output])
+        snapshot_seconds = time.perf_counter() - start
+
+        results.append({
+            'accounts': count,
+            'legacy_seconds': round(legacy_seconds, 4),
+            'snapshot_seconds': round(snapshot_seconds, 4),
+            'speedup': round(legacy_seconds / snapshot_seconds, 1)
+        })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Drives `main:app` with a mix of requests and reports throughput and latency
+percentiles as JSON, so results can be compared across commits.
+
+Requests go through httpx's ASGI transport to the in-memory storage backend,
+seeded with a generated dataset, so the numbers measure the service itself
+rather than the network or MongoDB. Google tokens are not verified: the
+stubbed verifier treats the token as the email address that signs in.
+
+Run with `python -m benchmarks.load_test`, for example:
+
+    python -m benchmarks.load_test --accounts 1000 100000 1000000 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import httpx
+from main import app
+from models.Token import Token
+from util.memory_db import MemoryAuthDB
+
+ROLE_COUNT = 20
+ADMIN_COUNT = 10
+TOKENS_PER_OPERATION = 1000
+
+MIXES = {
+    'default': {'sign-in': 10, 'refresh': 20, 'login': 50,
+                'role-accounts': 15, 'update-roles': 5},
+    'read-heavy': {'sign-in': 2, 'refresh': 8, 'login': 70,
+                   'role-accounts': 20, 'update-roles': 0},
+    'write-heavy': {'sign-in': 20, 'refresh': 20, 'login': 20,
+                    'role-accounts': 10, 'update-roles': 30}
+}
+
+
+def make_dataset(account_count: int, seed: int) -> tuple[list[dict], list[dict]]:
+    """
+    Builds the roles and accounts. Administrators can read and write every
+    role; other accounts have one to three roles.
+    """
+    rng = random.Random(seed)
+    role_names = [f'role-{number}' for number in range(ROLE_COUNT)]
+    roles = [{'name': name,
+              'authorizations': {f'{name}:can_view': True, '_read': [], '_write': []}}
+             for name in role_names]
+    roles.append({'name': 'admin',
+                  'authorizations': {'root': True,
+                                     '_read': role_names,
+                                     '_write': role_names}})
+
+    accounts = [{'email': f'admin{number}@university.edu', 'roles': ['admin']}
+                for number in range(ADMIN_COUNT)]
+    accounts.extend({'email': f'user{number:07d}@university.edu',
+                     'roles': rng.sample(role_names, rng.randint(1, 3))}
+                    for number in range(account_count - ADMIN_COUNT))
+    return accounts, roles
+
+
+class Workload:
+    """Builds the requests of each operation from the seeded dataset."""
+
+    def __init__(self, accounts: list[dict], seed: int):
+        self.rng = random.Random(seed)
+        users = self.rng.sample(accounts[ADMIN_COUNT:],
+                                min(TOKENS_PER_OPERATION, len(accounts) - ADMIN_COUNT))
+        self.emails = [account['email'] for account in users]
+        self.tokens = [Token.generate_token(account) for account in users]
+        self.admin_tokens = [Token.generate_token(account)
+                             for account in accounts[:ADMIN_COUNT]]
+
+    def __admin_header(self) -> dict:
+        return {'Authorization': 'Bearer ' + self.rng.choice(self.admin_tokens)}
+
+    def request(self, operation: str) -> dict:
+        """Builds the keyword arguments of one httpx request."""
+        role = f'role-{self.rng.randrange(ROLE_COUNT)}'
+        if operation == 'sign-in':
+            return {'method': 'POST', 'url': '/google-sign-in',
+                    'json': {'token': self.rng.choice(self.emails)}}
+        if operation == 'refresh':
+            # Refresh tokens can only be used once.
+            return {'method': 'POST', 'url': '/refresh-token',
+                    'json': {'token': Token.generate_refresh_token(
+                        self.rng.choice(self.emails))}}
+        if operation == 'login':
+            return {'method': 'POST', 'url': '/login',
+                    'headers': {'Authorization': 'Bearer ' + self.rng.choice(self.tokens)}}
+        if operation == 'role-accounts':
+            return {'method': 'GET', 'url': '/role-accounts',
+                    'params': {'role': role, 'limit': 50},
+                    'headers': self.__admin_header()}
+        if operation == 'update-roles':
+            add_roles, remove_roles = ([role], []) if self.rng.random() < 0.5 else ([], [role])
+            return {'method': 'PUT', 'url': '/update-account-roles',
+                    'json': {'email': self.rng.choice(self.emails),
+                             'add_roles': add_roles,
+                             'remove_roles': remove_roles},
+                    'headers': self.__admin_header()}
+        raise ValueError(f'Unknown operation {operation}.')
+
+
+def verify_google_token(token: str) -> dict:
+    """Stands in for Google's verification: the token is the email address."""
+    return {'email': token}
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Gets a percentile of sorted values by the nearest-rank method."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies: list[float], errors: int, seconds: float) -> dict:
+    """Reports the throughput and latency percentiles of requests."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3)
+    }
+
+
+async def run(account_count: int, requests: int, concurrency: int,
+              mix: str, seed: int) -> dict:
+    """Seeds a dataset, then sends the requests and measures them."""
+    accounts, roles = make_dataset(account_count, seed)
+    start = time.perf_counter()
+    MemoryAuthDB.reset(accounts, roles)
+    seed_seconds = time.perf_counter() - start
+
+    workload = Workload(accounts, seed)
+    weights = MIXES[mix]
+    rng = random.Random(seed)
+    operations = rng.choices(list(weights), list(weights.values()), k=requests)
+    planned = [(operation, workload.request(operation)) for operation in operations]
+
+    latencies = {operation: [] for operation in weights}
+    errors = {operation: 0 for operation in weights}
+    queue = iter(planned)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://load-test') as client:
+        async def worker():
+            for operation, request in queue:
+                request_start = time.perf_counter()
+                response = await client.request(**request)
+                latencies[operation].append(time.perf_counter() - request_start)
+                if response.status_code >= 400:
+                    errors[operation] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+
+    return {
+        'accounts': account_count,
+        'mix': mix,
+        'concurrency': concurrency,
+        'seed_seconds': round(seed_seconds, 2),
+        'total': summarize([latency for values in latencies.values() for latency in values],
+                           sum(errors.values()), seconds),
+        'operations': {operation: summarize(values, errors[operation], seconds)
+                       for operation, values in latencies.items() if values}
+    }
+
+
+def current_commit() -> str:
+    """Gets the checked out commit, if this is a git repository."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--accounts', type=int, nargs='+', default=[1000],
+                        help='Dataset sizes to run, such as 1000 100000 1000000.')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--mix', choices=MIXES, default='default')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    os.environ['AUTH_STORAGE'] = 'memory'
+    os.environ.setdefault('JWT_SECRET', 'BENCHMARK_SECRET_WITH_AT_LEAST_32_BYTES')
+    Token.decode_google_token = verify_google_token
+
+    results = {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'requests': args.requests,
+        'runs': [asyncio.run(run(account_count, args.requests, args.concurrency,
+                                 args.mix, args.seed))
+                 for account_count in args.accounts]
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
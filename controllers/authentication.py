@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Header, Response, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from models.Account import Account
 from models.Token import Token
+from util.serialization import FastJSONResponse, dumps, encode_object
 
 router = APIRouter()
 
@@ -11,24 +13,30 @@ class TokenRequestBody(BaseModel):
 
 
 @router.post('/google-sign-in', tags=['Authentication'])
-def google_login(response: Response, body: TokenRequestBody):
+async def google_login(response: Response, body: TokenRequestBody):
     """Authenticates with Google Identity Services.
 
     The token, supplied by Google Identity Services, is passed in. Returned is a new token which can be used with other services.
     """
     try:
-        google_info = Token.decode_google_token(body.token)
+        google_info = await run_in_threadpool(Token.decode_google_token,
+                                              body.token)
         user_email = google_info['email']
-        account = Account.find_by_email(user_email)
+        account = await Account.find_by_email(user_email)
+        claims = account.to_dict()
+        Token.cache_claims(claims)
 
-        new_token = Token.generate_token(account.__dict__)
-        new_refresh_token = Token.generate_refresh_token(account.email)
+        # The claims are encoded once, for both the token and the response.
+        encoded_claims = dumps(claims)
+        new_token = Token.generate_token(claims, encoded_claims)
+        new_refresh_token = Token.generate_refresh_token(
+            account.email, authz_version=account.authz_version)
 
-        return {
+        return FastJSONResponse(encode_object({
             'token': new_token,
             'refresh_token': new_refresh_token,
-            'payload': account.__dict__
-        }
+            'payload': encoded_claims
+        }))
 
     except ValueError as e:
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -39,7 +47,7 @@ def google_login(response: Response, body: TokenRequestBody):
 
 
 @router.post('/login', tags=['Authentication'])
-def login(authorization: str = Header(default=None)):
+async def login(authorization: str = Header(default=None)):
     """Returns the payload of the token.
 
     The token, supplied by this service, is passed in. Returned is the payload that was contained in the token.
@@ -53,19 +61,61 @@ def login(authorization: str = Header(default=None)):
 
 
 @router.post('/refresh-token', tags=['Authentication'])
-def refresh_token(body: TokenRequestBody):
+async def refresh_token(body: TokenRequestBody):
     """Returns a new token and refresh token.
 
     The JWT used for authentication expires 15 minutes after it's generated. The refresh token can be used to extend the user's session with the app without asking them to sign back in. This function takes a refresh token, and it returns a new auth token (expires in 15 minutes) and a new refresh token.
+
+    Each refresh token can be used once. Using one again is treated as theft, and every refresh token from the same sign-in is revoked.
     """
-    payload = Token.decode_token(body.token)
-    account = Account.find_by_email(payload['email'])
+    payload = await Token.use_refresh_token(body.token)
+
+    # Re-sign the claims issued last time unless the account's roles or
+    # any of its roles changed since.
+    claims = await Token.find_current_claims(payload['email'],
+                                             payload.get('authz_version'))
+    if claims is None:
+        account = await Account.find_by_email(payload['email'])
+        claims = account.to_dict()
+        Token.cache_claims(claims)
+
+    # The claims are encoded once, for both the token and the response.
+    encoded_claims = dumps(claims)
+    new_token = Token.generate_token(claims, encoded_claims)
+    new_refresh_token = Token.generate_refresh_token(
+        claims['email'], family=payload['fam'],
+        authz_version=claims.get('authz_version'))
+
+    return FastJSONResponse(encode_object({
+        'token': new_token,
+        'refresh_token': new_refresh_token,
+        'payload': encoded_claims
+    }))
+
 
-    new_token = Token.generate_token(account.__dict__)
-    new_refresh_token = Token.generate_refresh_token(account.email)
+@router.post('/revoke-refresh-token', tags=['Authentication'])
+async def revoke_refresh_token(body: TokenRequestBody):
+    """Signs out by revoking a refresh token.
+
+    The refresh token, and every refresh token rotated from the same sign-in, can no longer be used. Auth tokens that were already issued stay valid until they expire.
+    """
+    payload = Token.decode_refresh_token(body.token)
+    await Token.revoke_family(payload)
 
     return {
-        'token': new_token,
-        'refresh_token': new_refresh_token,
-        'payload': account.__dict__
+        'revoked': True
     }
+
+
+@router.get('/.well-known/jwks.json', tags=['Authentication'])
+async def jwks(response: Response):
+    """Returns the public keys that verify tokens from this service.
+
+    When tokens are signed with an asymmetric algorithm (`JWT_ALGORITHM` is ES256 or EdDSA), other services can cache these keys and verify tokens locally, using the `kid` header to pick the key. The set is empty when tokens are signed with `JWT_SECRET`.
+    """
+    response.headers['Cache-Control'] = 'public, max-age=300'
+
+    key_ring = Token.get_key_ring()
+    if key_ring is None:
+        return {'keys': []}
+    return key_ring.jwks()
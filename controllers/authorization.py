@@ -1,9 +1,13 @@
 """Controller functions and routes for authorization CRUD."""
 
-from fastapi import APIRouter, Header, Response, status
+from fastapi import APIRouter, Header, Query, Response, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from models.Token import Token
 from models.Account import Account
+from util.permissions import READ, WRITE, permission_bits
+from util.serialization import FastJSONResponse, dumps
+from util.storage import get_storage
 
 router = APIRouter()
 
@@ -15,71 +19,158 @@ class UpdateAuthorizationRequestBody(BaseModel):
     remove_roles: list[str] = []
 
 
+class BulkUpdateAuthorizationRequestBody(BaseModel):
+    """Request body model."""
+    updates: list[UpdateAuthorizationRequestBody]
+
+
+class AuthorizeRequestBody(BaseModel):
+    """Request body model."""
+    permissions: list[str]
+
+
 @router.get('/role-accounts', tags=['Authorization'])
-def get_accounts_with_role(response: Response,
-                                    role: str,
-                                    authorization: str = Header(default=None)):
+async def get_accounts_with_role(response: Response,
+                                 role: str,
+                                 limit: int = Query(default=None, gt=0),
+                                 after: str = None,
+                                 stream: bool = False,
+                                 authorization: str = Header(default=None)):
     """Gets all accounts with specified roles.
 
     It may be necessary to query all accounts with a certain
     authorization. This endpoint can query accounts and return that
     list of accounts.
+
+    Accounts are ordered by email address. With `limit`, one page of accounts is returned along with `next`, the email address to pass as `after` to get the next page (or null on the last page). With `stream=true`, accounts are streamed as newline-delimited JSON while they are read from the database.
     """
 
     # Get read permissions of the requesting account.
     requesting_account = Token.decode_token(authorization.split(' ')[1])
-    requesting_account = Account.find_by_email(requesting_account['email'])
-    read_permissions: dict = requesting_account.authorizations.get('_read', [])
+    requesting_account = await Account.find_by_email(requesting_account['email'])
+    read_permissions = permission_bits.compile(requesting_account.authorizations)
 
     # If requesting user has permission, return accounts data.
-    if role in read_permissions:
-        accounts = Account.find_by_role(role)
+    if permission_bits.allows(read_permissions, [READ + role]):
+        if stream:
+            async def account_lines():
+                async for account in Account.stream_by_role(role, after, limit):
+                    yield dumps(account.to_dict()) + b'\n'
+
+            return StreamingResponse(account_lines(),
+                                     media_type='application/x-ndjson')
+
+        accounts = await Account.find_by_role(role, after, limit)
     else:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {
             'error': f'This account is not authorized to read {role} authorizations.'
         }
 
-    return {
-        'accounts': accounts
-    }
+    # Encoded in one pass, without converting every account for FastAPI's
+    # encoder first.
+    if limit is None:
+        return FastJSONResponse({
+            'accounts': [account.to_dict() for account in accounts]
+        })
+
+    return FastJSONResponse({
+        'accounts': [account.to_dict() for account in accounts],
+        'next': accounts[-1].email if len(accounts) == limit else None
+    })
 
 
 @router.put('/update-account-roles', tags=['Authorization'])
-def update_authorization(response: Response,
-                         body: UpdateAuthorizationRequestBody,
-                         authorization: str = Header(default=None)):
+async def update_authorization(response: Response,
+                               body: UpdateAuthorizationRequestBody,
+                               authorization: str = Header(default=None)):
     """Adds or removes roles granted to accounts."""
 
     # Get write permissions of the requesting account.
     requesting_account = Token.decode_token(authorization.split(' ')[1])
-    requesting_account = Account.find_by_email(requesting_account['email'])
-    write_permissions: dict = requesting_account.authorizations.get('_write', [])
-
-    account = Account.find_by_email(body.email)
+    requesting_account = await Account.find_by_email(requesting_account['email'])
+    write_permissions = permission_bits.compile(requesting_account.authorizations)
 
     # Verify that the requesting account has permission to assign this role.
-    can_assign_roles: bool = all(role in write_permissions for role in body.add_roles)
-    can_revoke_roles: bool = all(role in write_permissions for role in body.remove_roles)
+    can_assign_roles: bool = permission_bits.allows(
+        write_permissions, [WRITE + role for role in body.add_roles])
+    can_revoke_roles: bool = permission_bits.allows(
+        write_permissions, [WRITE + role for role in body.remove_roles])
 
     if can_assign_roles and can_revoke_roles:
-        for role in body.remove_roles:
-            account.remove_role(role)
-        for role in body.add_roles:
-            account.add_role(role)
-
-        account.update()
+        # One atomic write, so concurrent updates do not overwrite each other.
+        account = await Account.update_roles(body.email, body.add_roles,
+                                             body.remove_roles)
     else:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {
             'error': 'This account is not authorized to write to this user\'s authorization(s).'
         }
 
-    account_response = account.__dict__.copy()
-
-    if account_response.get('authorizations', False):
-        account_response.pop('authorizations')
+    account_response = {field: value for field, value in account.to_dict().items()
+                        if field != 'authorizations'}
 
     return {
         'account': account_response
     }
+
+
+@router.put('/bulk-update-account-roles', tags=['Authorization'])
+async def bulk_update_authorization(body: BulkUpdateAuthorizationRequestBody,
+                                    authorization: str = Header(default=None)):
+    """Adds or removes roles granted to many accounts at once.
+
+    Every update is checked against the requesting account's write permissions, and the permitted updates are applied in a single bulk write. The results list the outcome of each update in the order they were given.
+    """
+
+    # Get write permissions of the requesting account.
+    requesting_account = Token.decode_token(authorization.split(' ')[1])
+    requesting_account = await Account.find_by_email(requesting_account['email'])
+    write_permissions = permission_bits.compile(requesting_account.authorizations)
+
+    permitted_updates = []
+    results = []
+    for update in body.updates:
+        roles = update.add_roles + update.remove_roles
+        if permission_bits.allows(write_permissions, [WRITE + role for role in roles]):
+            permitted_updates.append(update.model_dump())
+            results.append(None)
+        else:
+            results.append({
+                'email': update.email,
+                'status': 'error',
+                'error': 'This account is not authorized to write to this user\'s authorization(s).'
+            })
+
+    written_results = iter(await Account.update_roles_in_bulk(permitted_updates))
+
+    return {
+        'results': [result or next(written_results) for result in results]
+    }
+
+
+@router.post('/authorize', tags=['Authorization'])
+async def authorize(body: AuthorizeRequestBody,
+                    authorization: str = Header(default=None)):
+    """Decides whether a token grants permissions.
+
+    For services that do not decode tokens themselves. Each permission is an authorization key, such as `can_do_x`, or `_read:<role>` or `_write:<role>` for the right to read or write a role. Returned is a decision for each permission, and `allowed`, which is true if every permission is granted.
+
+    The token's roles are checked against the current role definitions, which are held in memory and compiled into permission bitsets, so a decision does not query the database.
+    """
+    payload = Token.decode_token(authorization.split(' ')[1])
+
+    storage = get_storage()
+    if storage.role_cache is None:
+        await storage.setup()
+    bits = permission_bits.compile(
+        storage.role_cache.resolve(payload.get('roles', [])))
+
+    decisions = {permission: permission_bits.allows(bits, [permission])
+                 for permission in body.permissions}
+
+    return {
+        'email': payload.get('email'),
+        'allowed': all(decisions.values()),
+        'decisions': decisions
+    }
@@ -0,0 +1,48 @@
+"""Routes that report whether the service is alive and ready for traffic."""
+
+import asyncio
+import os
+import sqlite3
+from fastapi import APIRouter, Response, status
+from pymongo.errors import PyMongoError
+from util.storage import get_storage
+
+router = APIRouter()
+
+
+@router.get('/healthz', tags=['Health'])
+async def liveness():
+    """Reports that the service is running. It does not check the database."""
+    return {'status': 'ok'}
+
+
+@router.get('/readyz', tags=['Health'])
+async def readiness(response: Response):
+    """Reports whether the service can reach the database.
+
+    The response includes the round trip time of a database ping, the utilization of the connection pool and the number of roles in the role snapshot. If the ping fails or takes longer than READINESS_TIMEOUT seconds, or the role snapshot has not loaded yet, the status code is 503.
+    """
+    storage = get_storage()
+    try:
+        latency = await asyncio.wait_for(
+            storage.ping(), float(os.getenv('READINESS_TIMEOUT', '2')))
+    except (PyMongoError, sqlite3.Error, asyncio.TimeoutError) as e:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {
+            'status': 'unavailable',
+            'error': str(e) or 'The database ping timed out.'
+        }
+
+    if storage.role_cache is None or not storage.role_cache.loaded:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {
+            'status': 'unavailable',
+            'error': 'The role snapshot has not loaded.'
+        }
+
+    return {
+        'status': 'ok',
+        'db_ping_ms': round(latency * 1000, 3),
+        'pool': storage.pool_stats.report() if storage.pool_stats else None,
+        'roles': len(storage.role_cache.roles)
+    }
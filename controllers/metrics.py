@@ -0,0 +1,50 @@
+"""Route that exports Prometheus metrics."""
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from models.Token import Token
+from util.metrics import get_registry
+from util.storage import get_storage
+
+router = APIRouter()
+
+
+class CacheCollector:
+    """
+    Exports the hits, misses and size of the in-memory caches. Caches are
+    per process, so with several workers these describe the worker that
+    serves the scrape.
+    """
+
+    def collect(self):
+        caches = {
+            'account': get_storage().account_cache,
+            'token': Token.token_cache
+        }
+        hits = CounterMetricFamily('auth_cache_hits', 'Cache hits.', labels=['cache'])
+        misses = CounterMetricFamily('auth_cache_misses', 'Cache misses.', labels=['cache'])
+        size = GaugeMetricFamily('auth_cache_size', 'Entries in the cache.', labels=['cache'])
+        for name, cache in caches.items():
+            if cache is None:
+                continue
+            stats = cache.stats()
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            size.add_metric([name], stats['size'])
+        yield hits
+        yield misses
+        yield size
+
+
+cache_collector = CacheCollector()
+REGISTRY.register(cache_collector)
+
+
+@router.get('/metrics', tags=['Metrics'])
+def metrics():
+    """Exports request, database, token and cache metrics in the Prometheus text format."""
+    registry = get_registry()
+    if registry is not REGISTRY:
+        registry.register(cache_collector)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -2,13 +2,23 @@
 The starting point for the auth service.
 """
 
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
 from controllers.authentication import router as authentication_router
 from controllers.authorization import router as authorization_router
+from controllers.health import router as health_router
+from controllers.metrics import router as metrics_router
+from util.metrics import MetricsMiddleware, mark_process_dead
+from util.serialization import FastJSONResponse
+from util.storage import get_storage
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 DESCRIPTION = """
 Handle authentication and authorization in your app. Sign in with Google and get back a token that will authenticate the user across multiple services and keep track of all authorizations across all of those services.
@@ -33,10 +43,29 @@ Each role has a number of authorizations tied to it. These authorizations are se
 Each auth JWT expires 15 minutes after it's generated. After expiring, the token is useless. To keep using the apps and services, a new token will have to be generated. So the user doesn't have to sign in every 15 minutes, a refresh token is used. Upon signing in, an auth token and refresh token is sent to the client. After the auth token expires, the refresh token can be used to generate another auth token. That refresh token expires 2 days after being generated, and it's replaced every time the auth token is replaced.
 """
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Connects to the storage backend and loads the role snapshot before the
+    first request, so the first requests do not wait on connection setup. If
+    MongoDB cannot be reached, the service still starts and `/readyz`
+    reports the failure.
+    """
+    try:
+        await get_storage().connect()
+    except PyMongoError as e:
+        logger.error('Could not connect to MongoDB on startup: %s', e)
+    yield
+    mark_process_dead()
+
+
 app = FastAPI(
     title='Auth Service',
     description=DESCRIPTION,
-    version="1.0.1"
+    version="1.0.1",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 app.add_middleware(
@@ -46,6 +75,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get('/', tags=['Default'])
@@ -56,3 +86,5 @@ def welcome():
 
 app.include_router(authentication_router)
 app.include_router(authorization_router)
+app.include_router(health_router)
+app.include_router(metrics_router)
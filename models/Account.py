@@ -1,63 +1,115 @@
 """A model to handle account CRUD."""
 
-from util.db import AuthDB
+from util.storage import get_storage
 
 
 class Account:
-    """The Account model handles CRUD functions for accounts."""
-    email = None
-    roles = []
-    authorizations = {}
+    """The Account model handles CRUD functions for accounts.
+
+    Accounts use slots instead of an instance dictionary, since a page of
+    accounts by role can hold tens of thousands of them. Roles are an
+    ordered tuple. The role frozenset is built on first use, and `to_dict`
+    builds the payload once and caches it.
+    """
+    # The fields of an account document, in the order they are serialized.
+    FIELDS = ('email', 'roles', 'authorizations', 'authz_version')
+    # Accounts share the tuple of fields they were given.
+    __field_sets = {}
+
+    __slots__ = ('email', 'roles', 'authorizations', 'authz_version', '__fields',
+                 '__role_set', '__payload')
 
     def __init__(self, config):
-        if 'email' in config:
-            self.email = config['email']
-        if 'roles' in config:
-            self.roles = list(set(config['roles']))
-        if 'authorizations' in config:
-            self.authorizations = config['authorizations']
-
-    def update(self):
+        self.email = config.get('email')
+        # Keeps the stored order, which updates preserve.
+        self.roles = tuple(dict.fromkeys(config.get('roles', ())))
+        self.authorizations = config.get('authorizations', {})
+        self.authz_version = config.get('authz_version')
+        # Only the fields that were given are serialized.
+        self.__fields = self.__field_set(field in config for field in self.FIELDS)
+        self.__role_set = None
+        self.__payload = None
+
+    @classmethod
+    def __field_set(cls, given):
+        """Gets the shared tuple of the fields that were given."""
+        given = tuple(given)
+        fields = cls.__field_sets.get(given)
+        if fields is None:
+            fields = tuple(field for field, is_given in zip(cls.FIELDS, given) if is_given)
+            cls.__field_sets[given] = fields
+        return fields
+
+    @property
+    def role_set(self):
+        """The account's roles, for membership checks."""
+        if self.__role_set is None:
+            self.__role_set = frozenset(self.roles)
+        return self.__role_set
+
+    def to_dict(self):
+        """Gets the account's fields as a dictionary, such as for a token
+        payload or a response. The dictionary is cached, so it must not be
+        modified.
+        """
+        if self.__payload is None:
+            payload = {field: getattr(self, field) for field in self.__fields}
+            if 'roles' in payload:
+                payload['roles'] = list(self.roles)
+            self.__payload = payload
+        return self.__payload
+
+    def __set_roles(self, roles):
+        """Replaces the roles, and the payload built from them."""
+        self.roles = roles
+        self.__fields = self.__field_set(field == 'roles' or field in self.__fields
+                                         for field in self.FIELDS)
+        self.__role_set = None
+        self.__payload = None
+
+    async def update(self):
         """Updates this instance in the database."""
-        return AuthDB.update_account(self.__dict__)
+        return await get_storage().update_account(self.to_dict())
 
     def add_role(self, role):
         """Adds a role to this user if it is not already added."""
-        if role not in self.roles:
-            self.roles.append(role)
+        if role not in self.role_set:
+            self.__set_roles(self.roles + (role,))
 
     def remove_role(self, role):
         """Removes a role from this user, if they have it."""
-        if role in self.roles:
-            self.roles.remove(role)
+        if role in self.role_set:
+            self.__set_roles(tuple(name for name in self.roles if name != role))
 
-    def delete(self):
+    async def delete(self):
         """Deletes this instance from the database."""
-        return AuthDB.delete_account(self.__dict__)
+        return await get_storage().delete_account(self.to_dict())
 
     @staticmethod
-    def find_by_email(email):
+    async def find_by_email(email):
         """
         Finds an account given an email address.
 
         Parameters:
             email: The email address of the account.
         """
-        db_account = AuthDB.get_account_by_email(email)
+        db_account = await get_storage().get_account_by_email(email)
         if db_account is None:
-            new_account = Account.create_account(email, None)
-            return new_account
-        else:
-            return Account(config=db_account)
+            db_account = await get_storage().get_or_create_account(
+                {'email': email, 'roles': []})
+        return Account(config=db_account)
 
     @staticmethod
-    def find_by_role(role):
+    async def find_by_role(role, after=None, limit=None):
         """
-        Finds accounts given authorization data.
+        Finds accounts with a role, ordered by email address.
 
-        :param filter: The attribute that should be searched.
+        :param role: The role which all returned accounts will have.
+        :param after: Only accounts with an email address after this one are returned.
+        :param limit: The maximum number of accounts to return.
         """
-        db_accounts = AuthDB.get_accounts_by_role(role)
+        db_accounts = await get_storage().get_accounts_by_role(role, after=after,
+                                                             limit=limit)
 
         accounts = []
         for account in db_accounts:
@@ -66,7 +118,43 @@ class Account:
         return accounts
 
     @staticmethod
-    def create_account(email, roles=None):
+    async def stream_by_role(role, after=None, limit=None):
+        """
+        Yields accounts with a role one at a time, ordered by email address.
+
+        :param role: The role which all returned accounts will have.
+        :param after: Only accounts with an email address after this one are returned.
+        :param limit: The maximum number of accounts to return.
+        """
+        async for account in get_storage().iter_accounts_by_role(role, after=after,
+                                                               limit=limit):
+            yield Account(config=account)
+
+    @staticmethod
+    async def update_roles(email, add_roles, remove_roles):
+        """
+        Adds and removes roles on an account in one atomic write, creating
+        the account if it does not exist.
+
+        :param email: The email address of the account.
+        :param add_roles: The roles to add.
+        :param remove_roles: The roles to remove.
+        """
+        account_data = await get_storage().update_account_roles(email, add_roles,
+                                                                remove_roles)
+        return Account(config=account_data)
+
+    @staticmethod
+    async def update_roles_in_bulk(updates):
+        """
+        Adds and removes roles on many accounts at once.
+
+        :param updates: Dictionaries with 'email', 'add_roles' and 'remove_roles'.
+        """
+        return await get_storage().update_roles_in_bulk(updates)
+
+    @staticmethod
+    async def create_account(email, roles=None):
         """
         Creates a new account in the database.
 
@@ -77,5 +165,5 @@ class Account:
             roles = []
         account_data = {'email': email,
                         'roles': roles}
-        AuthDB.create_account(account_data)
+        await get_storage().create_account(account_data)
         return Account(config=account_data)
@@ -1,55 +1,261 @@
+import hashlib
 import os
+import time
+import uuid
 import jwt
+import jwt.api_jws
+from calendar import timegm
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_auth_requests
+from util.cache import LRUCache
+from util.claims import compact_claims, expand_claims
+from util.google_certs import GOOGLE_CERTS_URL, GoogleCerts
+from util.keys import KeyRing
+from util.metrics import TOKEN_LATENCY, timed
+from util.revocations import RevocationList
+from util.serialization import dumps, prepend_field
+from util.storage import get_storage
 
 
 TOKEN_EXP_TIME = timedelta(minutes=15)
 REFRESH_TOKEN_EXP_TIME = timedelta(days=2)
+# Revoked families are recorded under this prefix, so they are the only
+# revocations kept in memory. Used token IDs are checked in storage.
+REVOKED_FAMILY_PREFIX = 'family:'
+GOOGLE_ISSUERS = ['accounts.google.com', 'https://accounts.google.com']
 
 class Token:
-    @staticmethod
-    def decode_google_token(token):
-        """Decodes a token from Google Identity Services.
+    google_certs = None
+    token_cache = None
+    token_cache_keys = None
+    key_ring = None
+    revocations = None
+    claims_cache = None
+
+    @classmethod
+    @timed(TOKEN_LATENCY)
+    def decode_google_token(cls, token):
+        """Decodes a token from Google Identity Services. Google's signing
+        keys are cached, so the token is verified locally.
         :param token: The token from Google.
         """
-        return id_token.verify_oauth2_token(token, google_auth_requests.Request(), os.getenv('GOOGLE_CLIENT_ID'))
+        if cls.google_certs is None:
+            cls.google_certs = GoogleCerts(os.getenv('GOOGLE_CERTS_URL',
+                                                     GOOGLE_CERTS_URL))
+
+        try:
+            header = jwt.get_unverified_header(token)
+            key = cls.google_certs.get_key(header.get('kid'))
+            if key is None:
+                raise ValueError('Token was signed with an unknown key.')
+
+            return jwt.decode(token, key, ['RS256'],
+                              audience=os.getenv('GOOGLE_CLIENT_ID'),
+                              issuer=GOOGLE_ISSUERS)
+        except jwt.exceptions.InvalidTokenError as e:
+            raise ValueError(str(e)) from e
+
+    @classmethod
+    def get_key_ring(cls):
+        """Gets the key ring used for asymmetric signing, or None when tokens
+        are signed with JWT_SECRET.
+        """
+        if os.getenv('JWT_ALGORITHM', 'HS256') == 'HS256':
+            return None
+        if cls.key_ring is None:
+            cls.key_ring = KeyRing.from_environment()
+        return cls.key_ring
 
-    @staticmethod
-    def decode_token(token):
-        """Decodes a JSON Web Token from this Auth Service.
+    @classmethod
+    def encode(cls, payload):
+        """Signs a payload with the active key, or with JWT_SECRET.
+        :param payload: The claims of the token, or the claims already
+            encoded as JSON bytes, which are signed as they are.
+        """
+        sign = jwt.api_jws.encode if isinstance(payload, bytes) else jwt.encode
+        key_ring = cls.get_key_ring()
+        if key_ring is None:
+            return sign(payload, os.getenv('JWT_SECRET'), 'HS256')
+
+        return sign(payload, key_ring.signing_key, key_ring.algorithm,
+                    headers={'kid': key_ring.active_kid})
+
+    @classmethod
+    @timed(TOKEN_LATENCY)
+    def decode_token(cls, token):
+        """Decodes a JSON Web Token from this Auth Service. Compact claims are
+        expanded back into the full payload. Verified payloads are cached
+        until the token expires, so the returned payload must not be modified.
         :param token: The token from this service.
         """
+        secret = os.getenv('JWT_SECRET')
+        key_ring = cls.get_key_ring()
+        verification_keys = secret
+        if key_ring is not None:
+            verification_keys = (secret, key_ring.algorithm,
+                                 tuple(key_ring.public_keys))
+
+        if cls.token_cache is None:
+            cls.token_cache = LRUCache(
+                maxsize=int(os.getenv('TOKEN_CACHE_SIZE', '10000')))
+        if cls.token_cache_keys != verification_keys:
+            # Tokens verified with a rotated secret or key are no longer trusted.
+            cls.token_cache.clear()
+            cls.token_cache_keys = verification_keys
+
+        cache_key = hashlib.sha256(token.encode()).digest()
+        payload = cls.token_cache.get(cache_key)
+        if payload is not None:
+            return payload
+
         try:
-            return jwt.decode(token, os.getenv('JWT_SECRET'), ['HS256'])
+            # Reading the header parses the whole token, so skip it when
+            # every token is signed with the secret.
+            header = jwt.get_unverified_header(token) if key_ring else {}
+            if key_ring is not None and header.get('alg') == key_ring.algorithm:
+                public_key = key_ring.public_keys.get(header.get('kid'))
+                if public_key is None:
+                    raise HTTPException(400, detail="Token was signed with an unknown key.")
+                payload = jwt.decode(token, public_key, [key_ring.algorithm])
+            elif secret is not None:
+                payload = jwt.decode(token, secret, ['HS256'])
+            else:
+                raise jwt.exceptions.InvalidSignatureError()
         except jwt.exceptions.ExpiredSignatureError:
             raise HTTPException(401, detail="Token is expired")
         except jwt.exceptions.InvalidSignatureError:
             raise HTTPException(400, detail=("Token has an invalid signature. "
                                              "Check the JWT_SECRET variable."))
 
-    @staticmethod
-    def generate_token(payload):
-        """Generates a JSON Web Token given a payload.
+        payload = expand_claims(payload)
+        if 'exp' in payload:
+            cls.token_cache.set(cache_key, payload,
+                                ttl=payload['exp'] - time.time())
+        return payload
+
+    @classmethod
+    @timed(TOKEN_LATENCY)
+    def generate_token(cls, payload, encoded_payload=None):
+        """Generates a JSON Web Token given a payload. With TOKEN_CLAIMS set
+        to 'compact' or 'deflate', the payload is stored as compact claims.
         :param payload: The object which will be encoded in the token.
+        :param encoded_payload: The payload already encoded as JSON, such as
+            for a response. Full claims reuse it instead of encoding again.
         """
-        token_payload = {'exp': datetime.now(tz=timezone.utc) + TOKEN_EXP_TIME}
+        expires_at = timegm((datetime.now(tz=timezone.utc) + TOKEN_EXP_TIME).utctimetuple())
+        claims_format = os.getenv('TOKEN_CLAIMS', 'full')
+
+        if claims_format == 'full' and encoded_payload is not None and 'exp' not in payload:
+            return cls.encode(prepend_field(encoded_payload, 'exp', expires_at))
+
+        token_payload = {'exp': expires_at}
         token_payload.update(payload)
+        if claims_format != 'full':
+            token_payload = compact_claims(token_payload,
+                                           deflate=claims_format == 'deflate')
 
-        return jwt.encode(token_payload, os.getenv('JWT_SECRET'), 'HS256')
+        return cls.encode(dumps(token_payload))
 
-    @staticmethod
-    def generate_refresh_token(email):
-        """Generates a refresh JWT given an email address.
+    @classmethod
+    def generate_refresh_token(cls, email, family=None, authz_version=None):
+        """Generates a refresh JWT given an email address. Each refresh token
+        has its own ID (`jti`), and the ID of the sign-in it descends from
+        (`fam`), so a whole chain of rotated tokens can be revoked at once.
         :param email: The email address of the user, which will be encoded in the token.
+        :param family: The family of the refresh token being rotated, if any.
+        :param authz_version: The authorization version of the claims issued
+            alongside this token.
+        """
+        # The family needs its own ID: revoking the first token's ID must
+        # not revoke the tokens rotated from it.
+        payload = {'email': email,
+                   'jti': uuid.uuid4().hex,
+                   'fam': family or uuid.uuid4().hex,
+                   'exp': datetime.now(tz=timezone.utc) + REFRESH_TOKEN_EXP_TIME}
+        if authz_version is not None:
+            payload['authz_version'] = authz_version
+        return cls.encode(payload)
+
+    @classmethod
+    def cache_claims(cls, claims):
+        """Keeps the claims issued to an account, so a refresh can re-sign
+        them while the account's authorization version is unchanged.
+        :param claims: The token payload, with 'email' and 'authz_version'.
         """
-        return jwt.encode({'email': email, 'exp': datetime.now(tz=timezone.utc) + REFRESH_TOKEN_EXP_TIME}, os.getenv('JWT_SECRET'), 'HS256')
+        if cls.claims_cache is None:
+            cls.claims_cache = LRUCache(
+                maxsize=int(os.getenv('CLAIMS_CACHE_SIZE', '10000')),
+                ttl=REFRESH_TOKEN_EXP_TIME.total_seconds())
+        if claims.get('authz_version') is not None:
+            cls.claims_cache.set(claims['email'], claims)
+
+    @classmethod
+    async def find_current_claims(cls, email, authz_version):
+        """Finds the claims last issued to an account, if the account's
+        authorization version still matches. Checking the version is a
+        cache hit or a point read that does not resolve roles.
+        :param email: The email address of the account.
+        :param authz_version: The authorization version in the refresh token.
+        """
+        if authz_version is None or cls.claims_cache is None:
+            return None
+        claims = cls.claims_cache.get(email)
+        if claims is None or claims.get('authz_version') != authz_version:
+            return None
+        if await get_storage().get_authz_version(email) != authz_version:
+            return None
+        return claims
 
     @classmethod
     def decode_refresh_token(cls, token):
-        """Decodes a refresh JWT from this Auth Service.
+        """Decodes a refresh JWT from this Auth Service. Tokens without a
+        token ID, such as auth tokens, are rejected.
         :param token: The refresh token from this service.
         """
-        return cls.decode_token(token)
+        payload = cls.decode_token(token)
+        if 'jti' not in payload or 'fam' not in payload:
+            raise HTTPException(400, detail="Token is not a refresh token.")
+        return payload
+
+    @classmethod
+    async def get_revocations(cls):
+        """Gets the revoked token IDs, syncing them if they are stale."""
+        if cls.revocations is None:
+            cls.revocations = RevocationList.from_environment(REVOKED_FAMILY_PREFIX)
+        await cls.revocations.sync(get_storage())
+        return cls.revocations
+
+    @classmethod
+    async def use_refresh_token(cls, token):
+        """Decodes a refresh token and revokes it, so it can be used once.
+        Revoked families are found in memory. Using a token a second time
+        means it was stolen, or its replacement was, so every token in its
+        family is revoked.
+        :param token: The refresh token from this service.
+        """
+        payload = cls.decode_refresh_token(token)
+        revocations = await cls.get_revocations()
+        storage = get_storage()
+
+        if REVOKED_FAMILY_PREFIX + payload['fam'] in revocations:
+            raise HTTPException(401, detail="Token has been revoked")
+        # Revoking the ID is atomic, so it catches a token used twice, even
+        # on different instances, without keeping used IDs in memory.
+        if not await storage.revoke_token(payload['jti'], payload['exp']):
+            await cls.revoke_family(payload)
+            raise HTTPException(401, detail="Token has been revoked")
+
+        return payload
+
+    @classmethod
+    async def revoke_family(cls, payload):
+        """Revokes every refresh token descended from the same sign-in.
+        :param payload: The payload of a refresh token in the family.
+        """
+        # Tokens rotated from this one expire at most one refresh token
+        # lifetime from now.
+        expires_at = (datetime.now(tz=timezone.utc) + REFRESH_TOKEN_EXP_TIME).timestamp()
+        family = REVOKED_FAMILY_PREFIX + payload['fam']
+        await get_storage().revoke_token(family, expires_at)
+        revocations = await cls.get_revocations()
+        revocations.add(family, expires_at)
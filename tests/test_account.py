@@ -0,0 +1,42 @@
+"""Tests for the Account model."""
+
+import pytest
+from models.Account import Account
+
+
+def test_account_to_dict():
+    """
+    It should serialize only the given fields, once, in a compact account.
+    """
+    account = Account({'email': 'member@university.edu',
+                       'roles': ['member', 'admin', 'member'],
+                       'authorizations': {'can_do_x': True,
+                                          '_read': ['member'],
+                                          '_write': []}})
+
+    assert account.to_dict() == {
+        'email': 'member@university.edu',
+        'roles': ['member', 'admin'],
+        'authorizations': {'can_do_x': True, '_read': ['member'], '_write': []}
+    }
+    assert account.to_dict() is account.to_dict()
+    assert account.role_set == frozenset({'member', 'admin'})
+    with pytest.raises(AttributeError):
+        account.nickname = 'member'
+
+
+def test_account_roles():
+    """
+    It should add and remove roles and rebuild the payload.
+    """
+    account = Account({'email': 'member@university.edu'})
+    assert account.to_dict() == {'email': 'member@university.edu'}
+
+    account.add_role('member')
+    account.add_role('admin')
+    account.add_role('member')
+    account.remove_role('admin')
+
+    assert account.roles == ('member',)
+    assert 'member' in account.role_set
+    assert account.to_dict() == {'email': 'member@university.edu', 'roles': ['member']}
@@ -1,8 +1,10 @@
+import asyncio
 import os
 from fastapi.testclient import TestClient
 from main import app
 from models.Account import Account
 from models.Token import Token
+from util.memory_db import MemoryAuthDB
 
 
 client = TestClient(app)
@@ -29,7 +31,7 @@ def test_decode_google_token(monkeypatch):
     def mock_decode_google_token(*args, **kwargs):
         return {'email': EMAIL}
 
-    def mock_find_by_email(*args, **kwargs):
+    async def mock_find_by_email(*args, **kwargs):
         return Account({'email': EMAIL, 'authorizations': {}})
 
     monkeypatch.setattr(Token, 'decode_google_token', mock_decode_google_token)
@@ -61,12 +63,14 @@ def test_decode_token():
 
 
 def test_refresh_token(monkeypatch):
-    def mock_find_by_email(*args, **kwargs):
+    async def mock_find_by_email(*args, **kwargs):
         return Account({'email': EMAIL, 'authorizations': {}})
 
+    monkeypatch.setenv('AUTH_STORAGE', 'memory')
     monkeypatch.setattr(Account, 'find_by_email', mock_find_by_email)
+    MemoryAuthDB.reset()
 
-    refresh_token = Token.generate_refresh_token({'email': EMAIL})
+    refresh_token = Token.generate_refresh_token(EMAIL)
 
     response = client.post('/refresh-token',
                            json={'token': refresh_token})
@@ -74,6 +78,10 @@ def test_refresh_token(monkeypatch):
     assert 'token' in response.json()
     assert 'refresh_token' in response.json()
 
+    response = client.post('/refresh-token',
+                           json={'token': response.json()['refresh_token']})
+    assert response.status_code == 200
+
     response = client.post('/refresh-token',
                            json={'token': EXPIRED_JWT})
     assert response.status_code == 401
@@ -85,3 +93,84 @@ def test_refresh_token(monkeypatch):
     assert response.status_code == 400
     assert 'token' not in response.json()
     assert 'refresh_token' not in response.json()
+
+    auth_token = Token.generate_token({'email': EMAIL})
+    response = client.post('/refresh-token',
+                           json={'token': auth_token})
+    assert response.status_code == 400
+    assert 'token' not in response.json()
+    assert 'refresh_token' not in response.json()
+
+
+def test_refresh_token_reuse(monkeypatch):
+    async def mock_find_by_email(*args, **kwargs):
+        return Account({'email': EMAIL, 'authorizations': {}})
+
+    monkeypatch.setenv('AUTH_STORAGE', 'memory')
+    monkeypatch.setattr(Account, 'find_by_email', mock_find_by_email)
+    MemoryAuthDB.reset()
+
+    stolen_token = Token.generate_refresh_token(EMAIL)
+    rotated_token = client.post('/refresh-token',
+                                json={'token': stolen_token}).json()['refresh_token']
+
+    # Using the token again revokes the token it was rotated into.
+    response = client.post('/refresh-token', json={'token': stolen_token})
+    assert response.status_code == 401
+    response = client.post('/refresh-token', json={'token': rotated_token})
+    assert response.status_code == 401
+    # Only the revoked family is kept in memory, not the used token IDs.
+    assert 'family:' + Token.decode_refresh_token(stolen_token)['fam'] in Token.revocations
+    assert all(jti.startswith('family:') for jti in Token.revocations.revoked)
+
+
+def test_revoke_refresh_token(monkeypatch):
+    monkeypatch.setenv('AUTH_STORAGE', 'memory')
+    MemoryAuthDB.reset()
+
+    refresh_token = Token.generate_refresh_token(EMAIL)
+
+    response = client.post('/revoke-refresh-token', json={'token': refresh_token})
+    assert response.status_code == 200
+    assert response.json() == {'revoked': True}
+
+    response = client.post('/refresh-token', json={'token': refresh_token})
+    assert response.status_code == 401
+
+
+def test_refresh_token_reuses_claims(monkeypatch):
+    def mock_decode_google_token(*args, **kwargs):
+        return {'email': EMAIL}
+
+    monkeypatch.setenv('AUTH_STORAGE', 'memory')
+    monkeypatch.setattr(Token, 'decode_google_token', mock_decode_google_token)
+    MemoryAuthDB.reset(roles=[{'name': 'member',
+                               'authorizations': {'can_do_x': True, '_read': [], '_write': []}}])
+
+    refresh_token = client.post('/google-sign-in',
+                                json={'token': 'token'}).json()['refresh_token']
+
+    lookups = []
+    find_by_email = Account.find_by_email
+
+    async def counting_find_by_email(email):
+        lookups.append(email)
+        return await find_by_email(email)
+
+    monkeypatch.setattr(Account, 'find_by_email', counting_find_by_email)
+
+    response = client.post('/refresh-token', json={'token': refresh_token})
+    assert response.status_code == 200
+    assert response.json()['payload']['roles'] == []
+    assert lookups == []
+
+    # A role change bumps the account's version, so the claims are rebuilt.
+    asyncio.run(MemoryAuthDB.update_roles_in_bulk(
+        [{'email': EMAIL, 'add_roles': ['member'], 'remove_roles': []}]))
+
+    response = client.post('/refresh-token',
+                           json={'token': response.json()['refresh_token']})
+    assert response.status_code == 200
+    assert response.json()['payload']['roles'] == ['member']
+    assert response.json()['payload']['authorizations']['can_do_x'] is True
+    assert lookups == [EMAIL]
@@ -1,10 +1,13 @@
 """Tests for the authorization controller functions."""
 
+import json
 import os
 from fastapi.testclient import TestClient
 from main import app
 from models.Token import Token
-from util.db import AuthDB
+from util.db import AsyncAuthDB
+from util.memory_db import MemoryAuthDB
+from util.storage import apply_role_update
 
 client = TestClient(app)
 
@@ -58,7 +61,7 @@ def test_get_accounts_with_role(monkeypatch):
     """
     It should get all users with a role.
     """
-    def mock_get_account_by_email(*_, **__):
+    async def mock_get_account_by_email(*_, **__):
         return {
             'email': 'admin@university.edu',
             'roles': ['admin'],
@@ -69,7 +72,7 @@ def test_get_accounts_with_role(monkeypatch):
             }
         }
 
-    def mock_get_accounts_by_role(*_, **__):
+    async def mock_get_accounts_by_role(*_, **__):
         return [
             {
                 'email': 'member@university.edu',
@@ -83,11 +86,11 @@ def test_get_accounts_with_role(monkeypatch):
             }
         ]
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_account_by_email',
                         mock_get_account_by_email)
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_accounts_by_role',
                         mock_get_accounts_by_role)
 
@@ -122,11 +125,107 @@ def test_get_accounts_with_role(monkeypatch):
     assert 'accounts' not in invalid_response.json()
 
 
+def test_get_accounts_with_role_paginated(monkeypatch):
+    """
+    It should get one page of users with a role and the cursor for the next page.
+    """
+    async def mock_get_account_by_email(*_, **__):
+        return {
+            'email': 'admin@university.edu',
+            'roles': ['admin'],
+            'authorizations': {
+                'root': True,
+                '_read': ['admin', 'member'],
+                '_write': ['admin', 'member']
+            }
+        }
+
+    async def mock_get_accounts_by_role(role, after=None, limit=None):
+        emails = ['member1@university.edu', 'member2@university.edu']
+        return [{'email': email, 'roles': [role]}
+                for email in emails if after is None or email > after][:limit]
+
+    monkeypatch.setattr(AsyncAuthDB,
+                        'get_account_by_email',
+                        mock_get_account_by_email)
+
+    monkeypatch.setattr(AsyncAuthDB,
+                        'get_accounts_by_role',
+                        mock_get_accounts_by_role)
+
+    token = Token.generate_token(ADMIN_ACCOUNT)
+    response = client.get(
+        '/role-accounts?role=member&limit=1',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        'accounts': [{'email': 'member1@university.edu', 'roles': ['member']}],
+        'next': 'member1@university.edu'
+    }
+
+    response = client.get(
+        '/role-accounts?role=member&limit=1&after=member1@university.edu',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.json()['next'] == 'member2@university.edu'
+
+    response = client.get(
+        '/role-accounts?role=member&limit=1&after=member2@university.edu',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.json() == {'accounts': [], 'next': None}
+
+
+def test_get_accounts_with_role_streamed(monkeypatch):
+    """
+    It should stream users with a role as newline-delimited JSON.
+    """
+    async def mock_get_account_by_email(*_, **__):
+        return {
+            'email': 'admin@university.edu',
+            'roles': ['admin'],
+            'authorizations': {
+                'root': True,
+                '_read': ['admin', 'member'],
+                '_write': ['admin', 'member']
+            }
+        }
+
+    async def mock_iter_accounts_by_role(role, after=None, limit=None):
+        for email in ['member1@university.edu', 'member2@university.edu']:
+            yield {'email': email, 'roles': [role]}
+
+    monkeypatch.setattr(AsyncAuthDB,
+                        'get_account_by_email',
+                        mock_get_account_by_email)
+
+    monkeypatch.setattr(AsyncAuthDB,
+                        'iter_accounts_by_role',
+                        mock_iter_accounts_by_role)
+
+    token = Token.generate_token(ADMIN_ACCOUNT)
+    response = client.get(
+        '/role-accounts?role=member&stream=true',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {'email': 'member1@university.edu', 'roles': ['member']},
+        {'email': 'member2@university.edu', 'roles': ['member']}
+    ]
+
+
 def test_get_account_with_role_unauthorized(monkeypatch):
     """
     It should fail to get users with a certain role if the requesting account does not have authorization.
     """
-    def mock_get_account_by_email(*_, **__):
+    async def mock_get_account_by_email(*_, **__):
         return {
             'email': 'member@university.edu',
             'roles': ['member'],
@@ -138,7 +237,7 @@ def test_get_account_with_role_unauthorized(monkeypatch):
             }
         }
 
-    def mock_get_accounts_by_role(*_, **__):
+    async def mock_get_accounts_by_role(*_, **__):
         return [
             {
                 'email': 'admin@university.edu',
@@ -151,11 +250,11 @@ def test_get_account_with_role_unauthorized(monkeypatch):
             }
         ]
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_account_by_email',
                         mock_get_account_by_email)
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_accounts_by_role',
                         mock_get_accounts_by_role)
 
@@ -180,7 +279,7 @@ def test_add_role(monkeypatch):
     """
     It should be able to add a role to an account.
     """
-    def mock_get_account_by_email(email):
+    async def mock_get_account_by_email(email):
         if email == 'member@university.edu':
             return {
                 'email': 'member@university.edu',
@@ -203,16 +302,19 @@ def test_add_role(monkeypatch):
                 }
             }
 
-    def mock_update_account(account_data):
+    async def mock_update_account_roles(email, add_roles, remove_roles):
+        account_data = await mock_get_account_by_email(email)
+        account_data['roles'] = apply_role_update(account_data['roles'],
+                                                  add_roles, remove_roles)
         return account_data
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_account_by_email',
                         mock_get_account_by_email)
 
-    monkeypatch.setattr(AuthDB,
-                        'update_account',
-                        mock_update_account)
+    monkeypatch.setattr(AsyncAuthDB,
+                        'update_account_roles',
+                        mock_update_account_roles)
 
     token = Token.generate_token(ADMIN_ACCOUNT)
     response = client.put(
@@ -259,7 +361,7 @@ def test_add_role_unauthorized(monkeypatch):
     """
     It should fail to add roles to an account if the requesting account does not have authorization.
     """
-    def mock_get_account_by_email(email):
+    async def mock_get_account_by_email(email):
         if email == 'member@university.edu':
             return {
                 'email': 'member@university.edu',
@@ -282,16 +384,19 @@ def test_add_role_unauthorized(monkeypatch):
                 }
             }
 
-    def mock_update_account(account_data):
+    async def mock_update_account_roles(email, add_roles, remove_roles):
+        account_data = await mock_get_account_by_email(email)
+        account_data['roles'] = apply_role_update(account_data['roles'],
+                                                  add_roles, remove_roles)
         return account_data
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_account_by_email',
                         mock_get_account_by_email)
 
-    monkeypatch.setattr(AuthDB,
-                        'update_account',
-                        mock_update_account)
+    monkeypatch.setattr(AsyncAuthDB,
+                        'update_account_roles',
+                        mock_update_account_roles)
 
     token = Token.generate_token(MEMBER_ACCOUNT)
     response = client.put(
@@ -316,7 +421,7 @@ def test_remove_role(monkeypatch):
     """
     It should be able to remove multiple roles from an account.
     """
-    def mock_get_account_by_email(email):
+    async def mock_get_account_by_email(email):
         if email == 'member@university.edu':
             return {
                 'email': 'member@university.edu',
@@ -339,16 +444,19 @@ def test_remove_role(monkeypatch):
                 }
             }
 
-    def mock_update_account(account_data):
+    async def mock_update_account_roles(email, add_roles, remove_roles):
+        account_data = await mock_get_account_by_email(email)
+        account_data['roles'] = apply_role_update(account_data['roles'],
+                                                  add_roles, remove_roles)
         return account_data
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_account_by_email',
                         mock_get_account_by_email)
 
-    monkeypatch.setattr(AuthDB,
-                        'update_account',
-                        mock_update_account)
+    monkeypatch.setattr(AsyncAuthDB,
+                        'update_account_roles',
+                        mock_update_account_roles)
 
     token = Token.generate_token(ADMIN_ACCOUNT)
     response = client.put(
@@ -375,7 +483,7 @@ def test_remove_role_unauthorized(monkeypatch):
     """
     It should fail to remove roles if the requesting account does not have permission.
     """
-    def mock_get_account_by_email(email):
+    async def mock_get_account_by_email(email):
         if email == 'member@university.edu':
             return {
                 'email': 'member@university.edu',
@@ -398,16 +506,19 @@ def test_remove_role_unauthorized(monkeypatch):
                 }
             }
 
-    def mock_update_account(account_data):
+    async def mock_update_account_roles(email, add_roles, remove_roles):
+        account_data = await mock_get_account_by_email(email)
+        account_data['roles'] = apply_role_update(account_data['roles'],
+                                                  add_roles, remove_roles)
         return account_data
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_account_by_email',
                         mock_get_account_by_email)
 
-    monkeypatch.setattr(AuthDB,
-                        'update_account',
-                        mock_update_account)
+    monkeypatch.setattr(AsyncAuthDB,
+                        'update_account_roles',
+                        mock_update_account_roles)
 
     token = Token.generate_token(MEMBER_ACCOUNT)
     response = client.put(
@@ -429,7 +540,7 @@ def test_add_and_remove_roles(monkeypatch):
     """
     It should be able to add and remove roles for an account.
     """
-    def mock_get_account_by_email(email):
+    async def mock_get_account_by_email(email):
         if email == 'member@university.edu':
             return {
                 'email': 'member@university.edu',
@@ -452,16 +563,19 @@ def test_add_and_remove_roles(monkeypatch):
                 }
             }
 
-    def mock_update_account(account_data):
+    async def mock_update_account_roles(email, add_roles, remove_roles):
+        account_data = await mock_get_account_by_email(email)
+        account_data['roles'] = apply_role_update(account_data['roles'],
+                                                  add_roles, remove_roles)
         return account_data
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_account_by_email',
                         mock_get_account_by_email)
 
-    monkeypatch.setattr(AuthDB,
-                        'update_account',
-                        mock_update_account)
+    monkeypatch.setattr(AsyncAuthDB,
+                        'update_account_roles',
+                        mock_update_account_roles)
 
     token = Token.generate_token(ADMIN_ACCOUNT)
     response = client.put(
@@ -489,7 +603,7 @@ def test_add_and_remove_roles_unauthorized(monkeypatch):
     """
     It should be able to add and remove roles for an account.
     """
-    def mock_get_account_by_email(email):
+    async def mock_get_account_by_email(email):
         if email == 'member@university.edu':
             return {
                 'email': 'member@university.edu',
@@ -512,16 +626,19 @@ def test_add_and_remove_roles_unauthorized(monkeypatch):
                 }
             }
 
-    def mock_update_account(account_data):
+    async def mock_update_account_roles(email, add_roles, remove_roles):
+        account_data = await mock_get_account_by_email(email)
+        account_data['roles'] = apply_role_update(account_data['roles'],
+                                                  add_roles, remove_roles)
         return account_data
 
-    monkeypatch.setattr(AuthDB,
+    monkeypatch.setattr(AsyncAuthDB,
                         'get_account_by_email',
                         mock_get_account_by_email)
 
-    monkeypatch.setattr(AuthDB,
-                        'update_account',
-                        mock_update_account)
+    monkeypatch.setattr(AsyncAuthDB,
+                        'update_account_roles',
+                        mock_update_account_roles)
 
     token = Token.generate_token(MEMBER_ACCOUNT)
     response = client.put(
@@ -538,3 +655,109 @@ def test_add_and_remove_roles_unauthorized(monkeypatch):
     assert response.json() == {
         'error': 'This account is not authorized to write to this user\'s authorization(s).'
     }
+
+
+def test_bulk_update_roles(monkeypatch):
+    """
+    It should apply permitted role updates in bulk and reject the rest.
+    """
+    async def mock_get_account_by_email(*_, **__):
+        return {
+            'email': 'admin@university.edu',
+            'roles': ['admin'],
+            'authorizations': {
+                'root': True,
+                '_read': ['member'],
+                '_write': ['member']
+            }
+        }
+
+    written_updates = []
+
+    async def mock_update_roles_in_bulk(updates):
+        written_updates.extend(updates)
+        return [{'email': update['email'], 'status': 'updated'}
+                for update in updates]
+
+    monkeypatch.setattr(AsyncAuthDB,
+                        'get_account_by_email',
+                        mock_get_account_by_email)
+
+    monkeypatch.setattr(AsyncAuthDB,
+                        'update_roles_in_bulk',
+                        mock_update_roles_in_bulk)
+
+    token = Token.generate_token(ADMIN_ACCOUNT)
+    response = client.put(
+        '/bulk-update-account-roles',
+        headers={'Authorization': f'Bearer {token}'},
+        json={
+            'updates': [
+                {'email': 'student1@university.edu', 'add_roles': ['member']},
+                {'email': 'student2@university.edu', 'add_roles': ['admin']},
+                {'email': 'student3@university.edu', 'remove_roles': ['member']}
+            ]
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        'results': [
+            {'email': 'student1@university.edu', 'status': 'updated'},
+            {
+                'email': 'student2@university.edu',
+                'status': 'error',
+                'error': 'This account is not authorized to write to this user\'s authorization(s).'
+            },
+            {'email': 'student3@university.edu', 'status': 'updated'}
+        ]
+    }
+    assert [update['email'] for update in written_updates] == [
+        'student1@university.edu',
+        'student3@university.edu'
+    ]
+
+
+def test_authorize(monkeypatch):
+    """
+    It should decide many permissions from the role definitions without reading accounts.
+    """
+    async def mock_find_account(email):
+        raise AssertionError('Accounts should not be read.')
+
+    monkeypatch.setenv('AUTH_STORAGE', 'memory')
+    MemoryAuthDB.reset(roles=[ADMIN_ROLE, MEMBER_ROLE])
+    monkeypatch.setattr(MemoryAuthDB, '_find_account', mock_find_account)
+
+    token = Token.generate_token(MEMBER_ACCOUNT)
+    response = client.post(
+        '/authorize',
+        headers={'Authorization': f'Bearer {token}'},
+        json={'permissions': ['can_do_x', 'can_do_y']}
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        'email': 'member@university.edu',
+        'allowed': True,
+        'decisions': {'can_do_x': True, 'can_do_y': True}
+    }
+
+    token = Token.generate_token({'email': 'admin@university.edu', 'roles': ['admin']})
+    response = client.post(
+        '/authorize',
+        headers={'Authorization': f'Bearer {token}'},
+        json={'permissions': ['root', '_write:member', '_read:student', 'can_do_x']}
+    )
+    assert response.json() == {
+        'email': 'admin@university.edu',
+        'allowed': False,
+        'decisions': {'root': True, '_write:member': True,
+                      '_read:student': False, 'can_do_x': False}
+    }
+
+    expired_response = client.post(
+        '/authorize',
+        headers={'Authorization': f'Bearer {EXPIRED_JWT}'},
+        json={'permissions': ['can_do_x']}
+    )
+    assert expired_response.status_code == 401
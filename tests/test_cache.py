@@ -0,0 +1,81 @@
+"""Tests for the in-process caches."""
+
+import time
+from util.cache import LRUCache
+
+
+def test_cache_hit_and_miss():
+    """
+    It should return cached values and count hits and misses.
+    """
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('user@university.edu', {'roles': ['admin']})
+
+    assert cache.get('user@university.edu') == {'roles': ['admin']}
+    assert cache.get('other@university.edu') is None
+    assert cache.stats() == {
+        'hits': 1,
+        'misses': 1,
+        'hit_ratio': 0.5,
+        'size': 1,
+        'maxsize': 2
+    }
+
+
+def test_cache_evicts_least_recently_used():
+    """
+    It should evict the least recently used entry when full.
+    """
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_cache_expires_entries():
+    """
+    It should not return entries after their TTL.
+    """
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1, ttl=0.01)
+    time.sleep(0.02)
+
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_cache_invalidate():
+    """
+    It should remove invalidated entries.
+    """
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.invalidate('a')
+
+    assert cache.get('a') is None
+
+
+def test_cache_fill_skips_written_entries():
+    """
+    It should not fill an entry that was set or invalidated while its value was read.
+    """
+    cache = LRUCache(maxsize=2, ttl=60)
+
+    token = cache.start_fill('a')
+    assert cache.fill('a', token, 1) is True
+    assert cache.get('a') == 1
+
+    token = cache.start_fill('a')
+    cache.set('a', 2)
+    assert cache.fill('a', token, 1) is False
+    assert cache.get('a') == 2
+
+    token = cache.start_fill('a')
+    cache.invalidate('a')
+    assert cache.fill('a', token, 1) is False
+    assert cache.get('a') is None
@@ -0,0 +1,59 @@
+"""Tests for the compact claim format."""
+
+import pytest
+from models.Token import Token
+from util.claims import compact_claims, expand_claims
+
+PAYLOAD = {
+    'email': 'admin@university.edu',
+    'roles': ['admin', 'member'],
+    'authorizations': {
+        'root': True,
+        '_read': ['admin', 'member', 'liaison'],
+        '_write': ['member', 'liaison']
+    }
+}
+
+
+@pytest.mark.parametrize('deflate', [False, True])
+def test_compact_claims_round_trip(deflate):
+    """
+    It should expand compact claims back into the original payload.
+    """
+    claims = compact_claims({'exp': 4099737800, **PAYLOAD}, deflate=deflate)
+
+    assert claims['exp'] == 4099737800
+    assert expand_claims(claims) == {'exp': 4099737800, **PAYLOAD}
+
+
+def test_compact_claims_deduplicate_roles():
+    """
+    It should store each role name once.
+    """
+    claims = compact_claims(PAYLOAD)
+
+    assert claims['t'] == ['admin', 'member', 'liaison']
+    assert claims['rd'] == [0, 1, 2]
+    assert claims['wr'] == [1, 2]
+
+
+def test_expand_claims_leaves_full_payloads():
+    """
+    It should return payloads that are not compact unchanged.
+    """
+    assert expand_claims(PAYLOAD) is PAYLOAD
+
+
+@pytest.mark.parametrize('claims_format', ['compact', 'deflate'])
+def test_compact_tokens(monkeypatch, claims_format):
+    """
+    It should sign compact tokens and decode them into the full payload.
+    """
+    monkeypatch.setenv('JWT_SECRET', 'TEST_SECRET')
+    monkeypatch.setenv('TOKEN_CLAIMS', claims_format)
+
+    token = Token.generate_token(PAYLOAD)
+    payload = Token.decode_token(token)
+
+    assert payload.pop('exp')
+    assert payload == PAYLOAD
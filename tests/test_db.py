@@ -0,0 +1,521 @@
+"""Tests for the database helpers, run against an in-memory stand-in for MongoDB."""
+
+import asyncio
+import logging
+import time
+from copy import deepcopy
+import pytest
+from pymongo import ReplaceOne
+from pymongo.errors import (BulkWriteError, ConnectionFailure, OperationFailure,
+                            ServerSelectionTimeoutError)
+from util import db
+from util.cache import LRUCache
+from models.Account import Account
+from util.db import (AsyncAuthDB, RoleCache, account_role_update,
+                     check_query_plans, role_update_operations,
+                     role_update_results, uses_collection_scan)
+from util.permissions import permission_bits
+
+ADMIN_ROLE = {
+    'name': 'admin',
+    'authorizations': {
+        'root': True,
+        '_read': ['admin', 'member'],
+        '_write': ['admin', 'member']
+    }
+}
+
+MEMBER_ROLE = {
+    'name': 'member',
+    'authorizations': {
+        'can_do_x': True,
+        '_read': [],
+        '_write': []
+    }
+}
+
+
+class StandInCursor:
+    """Implements the parts of a pymongo cursor used by AsyncAuthDB and RoleCache."""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction):
+        self.documents.sort(key=lambda document: document.get(key),
+                            reverse=direction < 0)
+        return self
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+
+class StandInCollection:
+    """Implements the parts of a pymongo collection used by AsyncAuthDB and RoleCache."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = 0
+
+    @staticmethod
+    def __matches(document, query):
+        for key, value in query.items():
+            field = document.get(key)
+            if isinstance(value, dict) and '$in' in value:
+                values = field if isinstance(field, list) else [field]
+                if not set(values) & set(value['$in']):
+                    return False
+            elif isinstance(value, dict) and '$not' in value:
+                if field is not None and field > value['$not']['$gt']:
+                    return False
+            elif isinstance(value, dict):
+                if field is None or not field > value['$gt']:
+                    return False
+            elif isinstance(field, list):
+                if value not in field:
+                    return False
+            elif field != value:
+                return False
+        return True
+
+    def find(self, query=None, projection=None):
+        self.queries += 1
+        return StandInCursor([deepcopy(document) for document in self.documents
+                              if self.__matches(document, query or {})])
+
+    def find_one(self, query=None, projection=None):
+        return next(iter(self.find(query, projection)), None)
+
+    def find_one_and_update(self, query, update, projection=None,
+                            upsert=False, return_document=None):
+        self.queries += 1
+        for document in self.documents:
+            if self.__matches(document, query):
+                return deepcopy(document)
+        if upsert:
+            document = {**query, **update.get('$setOnInsert', {})}
+            self.documents.append(document)
+            return deepcopy(document)
+        return None
+
+    def bulk_write(self, operations, ordered=True):
+        errors = []
+        for index, operation in enumerate(operations):
+            matched = [document for document in self.documents
+                       if self.__matches(document, operation._filter)]
+            self.documents[:] = [document for document in self.documents
+                                 if document not in matched]
+            if not isinstance(operation, ReplaceOne):
+                continue
+            if not matched and any(document['email'] == operation._doc['email']
+                                   for document in self.documents):
+                # The upsert conflicts with the unique index on email.
+                errors.append({'index': index, 'code': 11000})
+                continue
+            self.documents.append(deepcopy(operation._doc))
+        if errors:
+            raise BulkWriteError({'writeErrors': errors})
+
+    def create_indexes(self, indexes):
+        pass
+
+    def watch(self, *_, **__):
+        raise OperationFailure('The $changeStream stage is only supported '
+                               'on replica sets')
+
+
+class AsyncStandInCollection:
+    """Implements the parts of an asynchronous pymongo collection used by AsyncAuthDB."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return self.collection.find_one_and_update(*args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return self.collection.bulk_write(*args, **kwargs)
+
+
+def use_stand_in(monkeypatch, accounts, roles) -> StandInCollection:
+    """
+    Points AsyncAuthDB at stand-in collections.
+
+    Returns:
+        The stand-in 'accounts' collection.
+    """
+    role_cache = RoleCache(StandInCollection(roles))
+    role_cache.load()
+    account_collection = StandInCollection(accounts)
+    monkeypatch.setattr(AsyncAuthDB, 'role_collection', role_cache.collection)
+    monkeypatch.setattr(AsyncAuthDB, 'account_cache', LRUCache())
+    monkeypatch.setattr(AsyncAuthDB, 'role_cache', role_cache)
+    monkeypatch.setattr(AsyncAuthDB, 'account_collection',
+                        AsyncStandInCollection(account_collection))
+    return account_collection
+
+
+def test_role_cache_resolve():
+    """
+    It should merge the authorizations of every role.
+    """
+    role_cache = RoleCache(StandInCollection([ADMIN_ROLE, MEMBER_ROLE]))
+    role_cache.load()
+
+    assert role_cache.resolve(['admin', 'member', 'missing']) == {
+        'root': True,
+        'can_do_x': True,
+        '_read': ['admin', 'member'],
+        '_write': ['admin', 'member']
+    }
+
+
+def test_role_cache_polls_without_change_streams():
+    """
+    It should reload roles on an interval when change streams are unavailable.
+    """
+    roles = [deepcopy(MEMBER_ROLE)]
+    role_cache = RoleCache(StandInCollection(roles), poll_interval=0.01)
+    changes = []
+    role_cache.listeners.append(lambda: changes.append(True))
+    role_cache.start()
+
+    roles.append(deepcopy(ADMIN_ROLE))
+    time.sleep(0.1)
+    role_cache.stop()
+
+    assert 'admin' in role_cache.roles
+    assert len(changes) == 2
+
+
+def test_get_role_cache_retries_failed_load(monkeypatch):
+    """
+    It should not share a role snapshot whose first load failed.
+    """
+    class UnreachableCollection(StandInCollection):
+        def find(self, query=None, projection=None):
+            raise ServerSelectionTimeoutError('No servers found yet')
+
+    monkeypatch.setattr(db, '_role_cache', None)
+    with pytest.raises(ServerSelectionTimeoutError):
+        db.get_role_cache(UnreachableCollection([]))
+
+    role_cache = db.get_role_cache(StandInCollection([deepcopy(ADMIN_ROLE)]))
+    role_cache.stop()
+
+    assert db.get_role_cache() is role_cache
+    assert role_cache.resolve(['admin'])['root'] is True
+
+
+class StandInClient:
+    """Implements the parts of an AsyncMongoClient used by AsyncAuthDB.setup."""
+
+    def __init__(self, clients):
+        self.closed = False
+        clients.append(self)
+
+    def __getitem__(self, name):
+        return StandInDatabase(name)
+
+    async def close(self):
+        self.closed = True
+
+
+class StandInDatabase:
+    """Implements the parts of an asynchronous pymongo database used by AsyncAuthDB.setup."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_collection(self, name):
+        collection = StandInCollection([])
+        collection.name = name
+        return collection
+
+
+def use_stand_in_setup(monkeypatch, provision) -> list[StandInClient]:
+    """
+    Resets AsyncAuthDB, and points its setup at stand-in clients, a
+    provisioning function and a loaded role snapshot.
+
+    Returns:
+        The clients setup creates.
+    """
+    clients = []
+    role_cache = RoleCache(StandInCollection([deepcopy(ADMIN_ROLE)]))
+    role_cache.load()
+    for name in ('client', 'account_collection', 'role_collection',
+                 'revoked_token_collection', 'resolved_account_collection',
+                 'role_cache', 'pool_stats', '_AsyncAuthDB__setup_lock',
+                 '_AsyncAuthDB__setup_loop'):
+        monkeypatch.setattr(AsyncAuthDB, name, None)
+    monkeypatch.setattr(AsyncAuthDB, '_AsyncAuthDB__setup_failures', 0)
+    monkeypatch.setattr(AsyncAuthDB, '_AsyncAuthDB__setup_retry_at', 0)
+    monkeypatch.setattr(AsyncAuthDB, 'account_cache', LRUCache())
+    monkeypatch.setattr(AsyncAuthDB, '_AsyncAuthDB__provision', provision)
+    monkeypatch.setattr(db, 'AsyncMongoClient', lambda *args, **kwargs: StandInClient(clients))
+    monkeypatch.setattr(db, 'get_role_cache', lambda: role_cache)
+    return clients
+
+
+def test_async_setup_retries_failed_provisioning(monkeypatch):
+    """
+    It should keep nothing from a failed setup, and retry it once the retry delay has passed.
+    """
+    attempts = []
+
+    async def provision(database, resolved_account_collection=None):
+        attempts.append(database.name)
+        if len(attempts) == 1:
+            raise ServerSelectionTimeoutError('No servers found yet')
+
+    clients = use_stand_in_setup(monkeypatch, provision)
+
+    with pytest.raises(ServerSelectionTimeoutError):
+        asyncio.run(AsyncAuthDB.setup())
+    assert AsyncAuthDB.account_collection is None
+    assert AsyncAuthDB.role_cache is None
+    assert clients[0].closed
+
+    # Calls within the retry delay fail without connecting.
+    with pytest.raises(ConnectionFailure):
+        asyncio.run(AsyncAuthDB.setup())
+    assert len(clients) == 1
+
+    monkeypatch.setattr(AsyncAuthDB, '_AsyncAuthDB__setup_retry_at', 0)
+    asyncio.run(AsyncAuthDB.setup())
+    assert attempts == ['Accounts', 'Accounts']
+    assert AsyncAuthDB.client is clients[1]
+    assert AsyncAuthDB.account_collection.name == 'accounts'
+    assert AsyncAuthDB.role_cache.resolve(['admin'])['root'] is True
+
+
+def test_concurrent_async_setups_share_one_client(monkeypatch):
+    """
+    It should build one client for setups that start while another is in progress.
+    """
+    async def provision(database, resolved_account_collection=None):
+        await asyncio.sleep(0.01)
+
+    clients = use_stand_in_setup(monkeypatch, provision)
+
+    async def run():
+        await asyncio.gather(*(AsyncAuthDB.setup() for _ in range(50)))
+
+    asyncio.run(run())
+
+    assert len(clients) == 1
+    assert AsyncAuthDB.client is clients[0]
+    assert not clients[0].closed
+
+
+def test_get_account_by_email(monkeypatch):
+    """
+    It should resolve roles from the snapshot and cache the account.
+    """
+    account_collection = use_stand_in(
+        monkeypatch,
+        [{'email': 'admin@university.edu', 'roles': ['admin', 'member']}],
+        [ADMIN_ROLE, MEMBER_ROLE])
+
+    account = asyncio.run(AsyncAuthDB.get_account_by_email('admin@university.edu'))
+    asyncio.run(AsyncAuthDB.get_account_by_email('admin@university.edu'))
+
+    assert account.pop('authz_version').startswith('0-')
+    assert account == {
+        'email': 'admin@university.edu',
+        'roles': ['admin', 'member'],
+        'authorizations': {
+            'root': True,
+            'can_do_x': True,
+            '_read': ['admin', 'member'],
+            '_write': ['admin', 'member']
+        }
+    }
+    assert account_collection.queries == 1
+    assert AsyncAuthDB.role_collection.queries == 1
+    assert AsyncAuthDB.account_cache.stats()['hits'] == 1
+
+
+def test_get_accounts_by_role(monkeypatch):
+    """
+    It should find every account with a role.
+    """
+    use_stand_in(monkeypatch,
+                 [{'email': 'admin@university.edu', 'roles': ['admin']},
+                  {'email': 'member@university.edu', 'roles': ['member']}],
+                 [ADMIN_ROLE, MEMBER_ROLE])
+
+    accounts = asyncio.run(AsyncAuthDB.get_accounts_by_role('member'))
+
+    assert accounts[0].pop('authz_version').startswith('0-')
+    assert accounts == [{
+        'email': 'member@university.edu',
+        'roles': ['member'],
+        'authorizations': {'can_do_x': True, '_read': [], '_write': []}
+    }]
+
+    accounts = asyncio.run(AsyncAuthDB.get_accounts_by_role('admin'))
+
+    assert accounts[0].pop('authz_version').startswith('0-')
+    assert accounts == [{
+        'email': 'admin@university.edu',
+        'roles': ['admin'],
+        'authorizations': {
+            'root': True,
+            '_read': ['admin', 'member'],
+            '_write': ['admin', 'member']
+        }
+    }]
+
+
+def test_find_by_email_creates_account_once(monkeypatch):
+    """
+    It should create a first-time account with a single upsert.
+    """
+    account_collection = use_stand_in(monkeypatch, [], [ADMIN_ROLE, MEMBER_ROLE])
+
+    account = asyncio.run(Account.find_by_email('new@university.edu'))
+    # The upsert's post-image is not cached, so the next lookup reads the
+    # account once and caches it.
+    asyncio.run(Account.find_by_email('new@university.edu'))
+    asyncio.run(Account.find_by_email('new@university.edu'))
+
+    assert account.email == 'new@university.edu'
+    assert account.roles == ()
+    assert account_collection.queries == 3
+    assert account_collection.documents == [
+        {'email': 'new@university.edu', 'roles': []}
+    ]
+
+
+def test_role_update_operations():
+    """
+    It should write each update with one atomic upsert and report results per update.
+    """
+    updates = [
+        {'email': 'a@university.edu', 'add_roles': ['member'], 'remove_roles': ['admin']},
+        {'email': 'b@university.edu', 'add_roles': ['member'], 'remove_roles': []}
+    ]
+
+    operations = role_update_operations(updates)
+
+    assert [operation._filter for operation in operations] == [
+        {'email': 'a@university.edu'},
+        {'email': 'b@university.edu'}
+    ]
+    assert [operation._doc for operation in operations] == [
+        account_role_update(['member'], ['admin']),
+        {'$addToSet': {'roles': {'$each': ['member']}}, '$inc': {'authz_version': 1}}
+    ]
+    assert all(operation._upsert for operation in operations)
+    assert role_update_results(updates, {
+        'upserted': [{'index': 1, '_id': 'id'}],
+        'writeErrors': [{'index': 0, 'errmsg': 'failed'}]
+    }) == [
+        {'email': 'a@university.edu', 'status': 'error', 'error': 'failed'},
+        {'email': 'b@university.edu', 'status': 'created'}
+    ]
+
+
+def test_account_role_update():
+    """
+    It should add roles with $addToSet, and use a pipeline when roles are also removed.
+    """
+    assert account_role_update(['member', 'member'], ['member']) == {
+        '$addToSet': {'roles': {'$each': ['member']}},
+        '$inc': {'authz_version': 1}
+    }
+
+    pipeline = account_role_update(['member'], ['admin'])
+    assert len(pipeline) == 1
+    update = pipeline[0]['$set']
+    assert update['authz_version'] == {'$add': [{'$ifNull': ['$authz_version', 0]}, 1]}
+    kept_roles, added_roles = update['roles']['$let']['in']['$concatArrays']
+    assert kept_roles['$filter']['cond'] == {
+        '$not': [{'$in': ['$$this', {'$literal': ['admin']}]}]}
+    assert added_roles['$filter']['input'] == {'$literal': ['member']}
+
+
+def test_get_accounts_by_role_pages(monkeypatch):
+    """
+    It should page through accounts with a role by email address.
+    """
+    use_stand_in(monkeypatch,
+                 [{'email': f'member{number}@university.edu', 'roles': ['member']}
+                  for number in (3, 1, 2)],
+                 [ADMIN_ROLE, MEMBER_ROLE])
+
+    first_page = asyncio.run(AsyncAuthDB.get_accounts_by_role('member', limit=2))
+    second_page = asyncio.run(AsyncAuthDB.get_accounts_by_role(
+        'member', after=first_page[-1]['email'], limit=2))
+
+    assert [account['email'] for account in first_page] == [
+        'member1@university.edu',
+        'member2@university.edu'
+    ]
+    assert [account['email'] for account in second_page] == [
+        'member3@university.edu'
+    ]
+
+
+def test_role_cache_compiles_permissions():
+    """
+    It should compile the permission bitset of each role combination once.
+    """
+    role_cache = RoleCache(StandInCollection([ADMIN_ROLE, MEMBER_ROLE]))
+    role_cache.load()
+
+    authorizations = role_cache.resolve(['admin', 'member'])
+
+    assert role_cache.resolve(['admin', 'member']) is authorizations
+    assert permission_bits.allows(authorizations.bits,
+                                  ['root', 'can_do_x', '_write:member'])
+
+
+def test_uses_collection_scan():
+    """
+    It should find COLLSCAN stages anywhere in the winning plan.
+    """
+    index_scan = {'queryPlanner': {'winningPlan': {
+        'stage': 'FETCH',
+        'inputStage': {'stage': 'IXSCAN', 'indexName': 'email_1'}
+    }}}
+    collection_scan = {'queryPlanner': {'winningPlan': {
+        'queryPlan': {
+            'stage': 'SORT',
+            'inputStage': {'stage': 'COLLSCAN', 'direction': 'forward'}
+        }
+    }}}
+
+    assert not uses_collection_scan(index_scan)
+    assert uses_collection_scan(collection_scan)
+
+
+def test_check_query_plans(caplog):
+    """
+    It should log or raise when a query scans a whole collection.
+    """
+    check_query_plans({'accounts by email': False})
+    assert not caplog.records
+
+    with caplog.at_level(logging.ERROR):
+        check_query_plans({'accounts by role': True})
+    assert 'accounts by role' in caplog.text
+
+    with pytest.raises(RuntimeError):
+        check_query_plans({'accounts by role': True}, fail=True)
@@ -0,0 +1,54 @@
+from fastapi.testclient import TestClient
+from pymongo.errors import ServerSelectionTimeoutError
+from main import app
+from util.db import AsyncAuthDB, PoolStats, RoleCache
+from tests.test_db import ADMIN_ROLE, StandInCollection
+
+client = TestClient(app)
+
+
+def test_healthz():
+    response = client.get('/healthz')
+    assert response.status_code == 200
+    assert response.json() == {'status': 'ok'}
+
+
+def test_readyz(monkeypatch):
+    async def mock_ping(*args, **kwargs):
+        return 0.0025
+
+    pool_stats = PoolStats(10)
+    pool_stats.connection_created(None)
+    pool_stats.connection_created(None)
+    pool_stats.connection_checked_out(None)
+
+    monkeypatch.setattr(AsyncAuthDB, 'ping', mock_ping)
+    monkeypatch.setattr(AsyncAuthDB, 'pool_stats', pool_stats)
+    monkeypatch.setattr(AsyncAuthDB, 'role_cache', RoleCache(StandInCollection([ADMIN_ROLE])))
+
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json()['error'] == 'The role snapshot has not loaded.'
+
+    AsyncAuthDB.role_cache.load()
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert response.json()['db_ping_ms'] == 2.5
+    assert response.json()['roles'] == 1
+    assert response.json()['pool'] == {
+        'open': 2,
+        'checked_out': 1,
+        'max_size': 10,
+        'utilization': 0.1
+    }
+
+
+def test_readyz_unavailable(monkeypatch):
+    async def mock_ping(*args, **kwargs):
+        raise ServerSelectionTimeoutError('No servers found yet')
+
+    monkeypatch.setattr(AsyncAuthDB, 'ping', mock_ping)
+
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json()['status'] == 'unavailable'
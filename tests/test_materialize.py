@@ -0,0 +1,145 @@
+"""Tests for the resolved_accounts collection, run against in-memory stand-ins."""
+
+import asyncio
+import logging
+from copy import deepcopy
+from pymongo.errors import ServerSelectionTimeoutError
+from models.Account import Account
+from util.db import AsyncAuthDB, RoleCache, materialize_operations
+from util.materialize import AccountMaterializer
+from tests.test_db import (ADMIN_ROLE, MEMBER_ROLE, AsyncStandInCollection,
+                           StandInCollection, use_stand_in)
+
+
+def make_materializer(accounts, resolved_accounts=()):
+    """Builds a materializer that follows a stand-in role snapshot."""
+    role_collection = StandInCollection([deepcopy(ADMIN_ROLE), deepcopy(MEMBER_ROLE)])
+    role_cache = RoleCache(role_collection)
+    role_cache.load()
+    materializer = AccountMaterializer(StandInCollection(accounts),
+                                       StandInCollection(list(resolved_accounts)),
+                                       role_cache)
+    role_cache.listeners.append(materializer.roles_changed)
+    return materializer, role_collection
+
+
+def test_rebuild_and_verify():
+    """
+    It should rebuild every resolved account, remove orphans and verify the result.
+    """
+    materializer, _ = make_materializer(
+        [{'email': 'admin@university.edu', 'roles': ['admin']},
+         {'email': 'member@university.edu', 'roles': ['member'], 'authz_version': 2}],
+        [{'email': 'deleted@university.edu', 'roles': [], 'authorizations': {}}])
+
+    report = materializer.verify()
+    assert report['consistent'] is False
+    assert report['missing']['count'] == 2
+    assert report['orphaned']['examples'] == ['deleted@university.edu']
+
+    assert materializer.rebuild() == {'written': 2, 'removed': 1}
+    assert materializer.verify()['consistent'] is True
+
+    member = materializer.resolved_account_collection.find_one(
+        {'email': 'member@university.edu'})
+    assert member['authorizations'] == {'can_do_x': True, '_read': [], '_write': []}
+    assert member['authz_version'].startswith('2-')
+
+    materializer.account_collection.documents[1]['roles'] = ['admin']
+    assert materializer.verify()['stale']['examples'] == ['member@university.edu']
+
+
+def test_role_change_recomputes_affected_accounts():
+    """
+    It should rewrite only the accounts with a role that changed.
+    """
+    materializer, role_collection = make_materializer(
+        [{'email': 'admin@university.edu', 'roles': ['admin']},
+         {'email': 'member@university.edu', 'roles': ['member']}])
+    materializer.rebuild()
+    resolved = materializer.resolved_account_collection
+    admin = resolved.find_one({'email': 'admin@university.edu'})
+
+    role_collection.documents[1]['authorizations']['can_do_y'] = True
+    written = []
+    refresh_roles = materializer.refresh_roles
+
+    def recording_refresh_roles(role_names):
+        written.append(sorted(role_names))
+        return refresh_roles(role_names)
+
+    materializer.refresh_roles = recording_refresh_roles
+    materializer.role_cache.load()
+
+    assert written == [['member']]
+    assert resolved.find_one({'email': 'member@university.edu'})['authorizations']['can_do_y']
+    assert resolved.find_one({'email': 'admin@university.edu'}) == admin
+    assert materializer.verify()['consistent'] is True
+    materializer.stop()
+
+
+def test_stale_worker_write_is_recomputed():
+    """
+    It should recompute an edited role's accounts again once every role snapshot has the edit.
+    """
+    materializer, role_collection = make_materializer(
+        [{'email': 'member@university.edu', 'roles': ['member'], 'authz_version': 1}])
+    materializer.settle_delay = 0.05
+    materializer.rebuild()
+    resolved = materializer.resolved_account_collection
+    # A worker whose snapshot has not seen the edit yet.
+    worker_role_cache = RoleCache(StandInCollection(deepcopy(role_collection.documents)))
+    worker_role_cache.load()
+
+    role_collection.documents[1]['authorizations']['can_do_y'] = True
+    materializer.role_cache.load()
+    assert resolved.find_one({'email': 'member@university.edu'})['authorizations']['can_do_y']
+
+    # The worker writes the account after the follower recomputed it, with a
+    # newer account version but the old role.
+    account_data = materializer.account_collection.documents[0]
+    account_data['authz_version'] = 2
+    resolved.bulk_write(materialize_operations([account_data['email']], [account_data],
+                                               worker_role_cache))
+    assert 'can_do_y' not in resolved.find_one({'email': 'member@university.edu'})['authorizations']
+
+    for timer in materializer._AccountMaterializer__rechecks:
+        timer.join()
+    assert resolved.find_one({'email': 'member@university.edu'})['authorizations']['can_do_y']
+    assert materializer.verify()['consistent'] is True
+
+
+def test_older_write_does_not_overwrite_newer():
+    """
+    It should keep a resolved document built from a newer version of the account.
+    """
+    role_cache = RoleCache(StandInCollection([deepcopy(ADMIN_ROLE), deepcopy(MEMBER_ROLE)]))
+    role_cache.load()
+    resolved = StandInCollection([])
+    newer = {'email': 'member@university.edu', 'roles': ['admin'], 'authz_version': 3}
+    older = {'email': 'member@university.edu', 'roles': ['member'], 'authz_version': 2}
+
+    resolved.bulk_write(materialize_operations([newer['email']], [newer], role_cache))
+    AccountMaterializer(StandInCollection([older]), resolved, role_cache).refresh_roles(['member'])
+
+    assert resolved.documents[0]['roles'] == ['admin']
+    assert resolved.documents[0]['account_version'] == 3
+
+
+def test_failed_materialization_is_logged(monkeypatch, caplog):
+    """
+    It should keep the account write and log a resolved document it could not write.
+    """
+    class UnreachableCollection(StandInCollection):
+        def bulk_write(self, operations, ordered=True):
+            raise ServerSelectionTimeoutError('No servers found yet')
+
+    use_stand_in(monkeypatch, [], [ADMIN_ROLE, MEMBER_ROLE])
+    monkeypatch.setattr(AsyncAuthDB, 'resolved_account_collection',
+                        AsyncStandInCollection(UnreachableCollection([])))
+
+    with caplog.at_level(logging.ERROR):
+        account = asyncio.run(Account.find_by_email('new@university.edu'))
+
+    assert account.email == 'new@university.edu'
+    assert 'Could not update the resolved documents' in caplog.text
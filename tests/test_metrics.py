@@ -0,0 +1,22 @@
+import os
+from fastapi.testclient import TestClient
+from main import app
+from models.Token import Token
+
+client = TestClient(app)
+os.environ["JWT_SECRET"] = "TEST_SECRET"
+
+
+def test_metrics():
+    client.get('/')
+    client.get('/does-not-exist')
+    Token.generate_token({'email': 'user@university.edu'})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'auth_request_duration_seconds_count{method="GET",route="/"}' in response.text
+    assert ('auth_request_errors_total{method="GET",route="unmatched",status="404"}'
+            in response.text)
+    assert ('auth_token_operation_duration_seconds_count{operation="Token.generate_token"}'
+            in response.text)
+    assert 'auth_requests_in_flight 1.0' in response.text
@@ -0,0 +1,36 @@
+"""Tests for the compiled permission bitsets."""
+
+from util.permissions import READ, WRITE, PermissionBits
+
+
+def test_compile_and_allow():
+    """
+    It should grant truthy authorizations and the roles that can be read or written.
+    """
+    permissions = PermissionBits()
+    bits = permissions.compile({
+        'can_do_x': True,
+        'can_do_y': False,
+        '_read': ['member'],
+        '_write': ['member', 'liaison']
+    })
+
+    assert permissions.allows(bits, ['can_do_x', READ + 'member'])
+    assert permissions.allows(bits, [WRITE + 'member', WRITE + 'liaison'])
+    assert permissions.allows(bits, [])
+    assert not permissions.allows(bits, ['can_do_y'])
+    assert not permissions.allows(bits, [READ + 'liaison'])
+    assert not permissions.allows(bits, ['never_granted'])
+    assert 'never_granted' not in permissions.indexes
+
+
+def test_merging_roles_is_an_or():
+    """
+    It should merge the permissions of roles with a bitwise OR.
+    """
+    permissions = PermissionBits()
+    admin = permissions.compile({'root': True, '_read': ['admin'], '_write': []})
+    member = permissions.compile({'can_do_x': True, '_read': [], '_write': []})
+
+    assert permissions.allows(admin | member, ['root', 'can_do_x', READ + 'admin'])
+
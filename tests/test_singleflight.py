@@ -0,0 +1,62 @@
+"""Tests for coalescing concurrent lookups."""
+
+import asyncio
+import pytest
+from util.memory_db import MemoryAuthDB
+from util.singleflight import AsyncSingleFlight
+from tests.test_db import ADMIN_ROLE, MEMBER_ROLE
+
+
+def test_concurrent_lookups_share_one_query(monkeypatch):
+    """
+    It should make one backend query for many concurrent identical lookups.
+    """
+    MemoryAuthDB.reset([{'email': 'admin@university.edu', 'roles': ['admin']}],
+                       [ADMIN_ROLE, MEMBER_ROLE])
+    queries = []
+    find_account = MemoryAuthDB._find_account
+
+    async def slow_find_account(email):
+        queries.append(email)
+        await asyncio.sleep(0.01)
+        return await find_account(email)
+
+    monkeypatch.setattr(MemoryAuthDB, '_find_account', slow_find_account)
+
+    async def run():
+        return await asyncio.gather(*(
+            MemoryAuthDB.get_account_by_email('admin@university.edu')
+            for _ in range(50)))
+
+    accounts = asyncio.run(run())
+
+    assert queries == ['admin@university.edu']
+    assert all(account['authorizations']['root'] is True for account in accounts)
+    # Every caller gets its own copy.
+    assert len({id(account) for account in accounts}) == 50
+    assert len(MemoryAuthDB.lookups) == 0
+
+
+def test_async_single_flight_shares_errors():
+    """
+    It should raise the error of a shared call in every caller, then call again.
+    """
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def fail():
+        calls.append(True)
+        await asyncio.sleep(0.01)
+        raise ValueError('failed')
+
+    async def run():
+        return await asyncio.gather(*(single_flight.do('key', fail) for _ in range(5)),
+                                    return_exceptions=True)
+
+    assert [str(error) for error in asyncio.run(run())] == ['failed'] * 5
+    assert len(calls) == 1
+
+    with pytest.raises(ValueError):
+        asyncio.run(single_flight.do('key', fail))
+    assert len(calls) == 2
+
@@ -0,0 +1,220 @@
+"""Tests for the in-memory and SQLite storage backends."""
+
+import asyncio
+import time
+import pytest
+from util.db import AsyncAuthDB
+from util.memory_db import MemoryAuthDB
+from util.sqlite_db import SqliteAuthDB
+from util.storage import apply_role_update, get_storage
+from tests.test_db import ADMIN_ROLE, MEMBER_ROLE
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, monkeypatch, tmp_path):
+    """Each storage backend, holding an admin and a member role."""
+    if request.param == 'memory':
+        MemoryAuthDB.reset(roles=[ADMIN_ROLE, MEMBER_ROLE])
+        yield MemoryAuthDB
+        return
+
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'auth.sqlite3'))
+    for role in (ADMIN_ROLE, MEMBER_ROLE):
+        asyncio.run(SqliteAuthDB.put_role(role))
+    yield SqliteAuthDB
+    SqliteAuthDB.close()
+
+
+def test_get_storage(monkeypatch):
+    """
+    It should select the backend named by AUTH_STORAGE.
+    """
+    assert get_storage() is AsyncAuthDB
+
+    monkeypatch.setenv('AUTH_STORAGE', 'memory')
+    assert get_storage() is MemoryAuthDB
+
+    monkeypatch.setenv('AUTH_STORAGE', 'redis')
+    with pytest.raises(ValueError):
+        get_storage()
+
+
+def test_apply_role_update():
+    """
+    It should add roles that are both added and removed, like the Mongo update.
+    """
+    assert apply_role_update(['a', 'b', 'c'], ['c', 'd'], ['b', 'c']) == ['a', 'c', 'd']
+
+
+def test_accounts(storage):
+    """
+    It should create, resolve, update and delete accounts.
+    """
+    async def run():
+        account = await storage.get_or_create_account(
+            {'email': 'admin@university.edu', 'roles': ['admin']})
+        assert account['authorizations']['root'] is True
+
+        await storage.update_account({**account, 'roles': ['member']})
+        account = await storage.get_account_by_email('admin@university.edu')
+        assert account['roles'] == ['member']
+        assert account['authorizations'] == {'can_do_x': True, '_read': [], '_write': []}
+
+        await storage.delete_account(account)
+        assert await storage.get_account_by_email('admin@university.edu') is None
+
+    asyncio.run(run())
+
+
+def test_update_account_roles(storage):
+    """
+    It should add and remove roles in one write and return the updated account.
+    """
+    async def run():
+        await storage.create_account({'email': 'a@university.edu', 'roles': ['admin']})
+        account = await storage.get_account_by_email('a@university.edu')
+        updated = await storage.update_account_roles('a@university.edu',
+                                                     ['member'], ['admin'])
+        created = await storage.update_account_roles('b@university.edu', [], ['admin'])
+        return account, updated, created
+
+    account, updated, created = asyncio.run(run())
+
+    assert updated['roles'] == ['member']
+    assert updated['authorizations'] == {'can_do_x': True, '_read': [], '_write': []}
+    assert updated['authz_version'] != account['authz_version']
+    assert created['email'] == 'b@university.edu'
+    assert created['roles'] == []
+
+
+def test_accounts_by_role(storage):
+    """
+    It should page through accounts with a role by email address.
+    """
+    async def run():
+        for number in (3, 1, 2):
+            await storage.create_account({'email': f'member{number}@university.edu',
+                                          'roles': ['member']})
+        await storage.create_account({'email': 'admin@university.edu',
+                                      'roles': ['admin']})
+
+        first_page = await storage.get_accounts_by_role('member', limit=2)
+        second_page = await storage.get_accounts_by_role(
+            'member', after=first_page[-1]['email'], limit=2)
+        return first_page, second_page
+
+    first_page, second_page = asyncio.run(run())
+
+    assert [account['email'] for account in first_page] == [
+        'member1@university.edu',
+        'member2@university.edu'
+    ]
+    assert [account['email'] for account in second_page] == [
+        'member3@university.edu'
+    ]
+    assert first_page[0]['authorizations']['can_do_x'] is True
+
+
+def test_update_roles_in_bulk(storage):
+    """
+    It should add and remove roles, creating missing accounts.
+    """
+    async def run():
+        await storage.create_account({'email': 'a@university.edu', 'roles': ['admin']})
+        results = await storage.update_roles_in_bulk([
+            {'email': 'a@university.edu', 'add_roles': ['member'], 'remove_roles': ['admin']},
+            {'email': 'b@university.edu', 'add_roles': ['admin'], 'remove_roles': []}
+        ])
+        admins = await storage.get_accounts_by_role('admin')
+        return results, admins
+
+    results, admins = asyncio.run(run())
+
+    assert results == [
+        {'email': 'a@university.edu', 'status': 'updated'},
+        {'email': 'b@university.edu', 'status': 'created'}
+    ]
+    assert [account['email'] for account in admins] == ['b@university.edu']
+
+
+def test_revoke_token(storage):
+    """
+    It should revoke a token ID once and sync revocations incrementally.
+    """
+    async def run():
+        expires_at = time.time() + 60
+        first = await storage.revoke_token('jti-1', expires_at)
+        second = await storage.revoke_token('jti-1', expires_at)
+        await storage.revoke_token('expired', time.time() - 1)
+        since = time.time()
+        await storage.revoke_token('jti-2', expires_at)
+        await storage.revoke_token('family:1', expires_at)
+        return (first, second, await storage.get_revoked_tokens(),
+                await storage.get_revoked_tokens(since),
+                await storage.get_revoked_tokens(prefix='family:'))
+
+    first, second, revoked, revoked_since, families = asyncio.run(run())
+
+    assert first and not second
+    assert [record['jti'] for record in revoked] == ['jti-1', 'jti-2', 'family:1']
+    assert [record['jti'] for record in revoked_since] == ['jti-2', 'family:1']
+    assert [record['jti'] for record in families] == ['family:1']
+
+
+def test_stale_load_is_not_cached(storage, monkeypatch):
+    """
+    It should not cache an account read before a concurrent role update.
+    """
+    async def run():
+        await storage.create_account({'email': 'a@university.edu', 'roles': ['admin']})
+        read = asyncio.Event()
+        updated = asyncio.Event()
+        find_account = storage._find_account
+
+        async def slow_find_account(email):
+            account_data = await find_account(email)
+            read.set()
+            await updated.wait()
+            return account_data
+
+        monkeypatch.setattr(storage, '_find_account', slow_find_account)
+        load = asyncio.create_task(storage.get_account_by_email('a@university.edu'))
+        await read.wait()
+        await storage.update_account_roles('a@university.edu', ['member'], ['admin'])
+        updated.set()
+
+        assert (await load)['roles'] == ['admin']
+        return await storage.get_account_by_email('a@university.edu')
+
+    assert asyncio.run(run())['roles'] == ['member']
+
+
+def test_out_of_order_role_updates_are_not_cached(storage, monkeypatch):
+    """
+    It should not cache an older post-image when concurrent role updates finish out of order.
+    """
+    async def run():
+        await storage.create_account({'email': 'a@university.edu', 'roles': []})
+        first_written = asyncio.Event()
+        second_done = asyncio.Event()
+        update_account_roles = storage._update_account_roles
+
+        async def reordered_update_account_roles(email, add_roles, remove_roles):
+            account_data = await update_account_roles(email, add_roles, remove_roles)
+            if add_roles == ['admin']:
+                # The first write is applied, but finishes after the second.
+                first_written.set()
+                await second_done.wait()
+            return account_data
+
+        monkeypatch.setattr(storage, '_update_account_roles', reordered_update_account_roles)
+        first = asyncio.create_task(
+            storage.update_account_roles('a@university.edu', ['admin'], []))
+        await first_written.wait()
+        await storage.update_account_roles('a@university.edu', ['member'], [])
+        second_done.set()
+        assert (await first)['roles'] == ['admin']
+
+        return await storage.get_account_by_email('a@university.edu')
+
+    assert asyncio.run(run())['roles'] == ['admin', 'member']
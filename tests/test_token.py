@@ -0,0 +1,201 @@
+"""Tests for the Token model."""
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import jwt
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.x509.oid import NameOID
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from main import app
+from models.Token import Token
+from util.google_certs import GoogleCerts
+from util.keys import KeyRing
+from util.serialization import dumps, encode_object
+
+client = TestClient(app)
+
+CLIENT_ID = 'test.apps.googleusercontent.com'
+KEY_ID = 'test-key'
+
+
+def generate_certificate():
+    """Creates an RSA key and a self-signed certificate for it."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'test')])
+    now = datetime.now(tz=timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name)
+                   .issuer_name(name)
+                   .public_key(private_key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now)
+                   .not_valid_after(now + timedelta(days=1))
+                   .sign(private_key, hashes.SHA256()))
+    return private_key, certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+PRIVATE_KEY, CERTIFICATE = generate_certificate()
+
+
+@pytest.fixture
+def google_certs(monkeypatch):
+    """Serves the test certificate from a local stand-in for Google's endpoint."""
+    class CertHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({KEY_ID: CERTIFICATE}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', 'public, max-age=3600')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CertHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    certs = GoogleCerts(f'http://127.0.0.1:{server.server_port}/certs')
+    monkeypatch.setattr(Token, 'google_certs', certs)
+    monkeypatch.setenv('GOOGLE_CLIENT_ID', CLIENT_ID)
+    yield certs
+    server.shutdown()
+
+
+def google_token(audience=CLIENT_ID):
+    """Signs a token the way Google Identity Services would."""
+    return jwt.encode({
+        'iss': 'https://accounts.google.com',
+        'aud': audience,
+        'email': 'user@university.edu',
+        'exp': datetime.now(tz=timezone.utc) + timedelta(hours=1)
+    }, PRIVATE_KEY, 'RS256', headers={'kid': KEY_ID})
+
+
+def test_decode_google_token_caches_certificates(google_certs):
+    """
+    It should verify Google tokens locally after the first certificate fetch.
+    """
+    for _ in range(3):
+        info = Token.decode_google_token(google_token())
+        assert info['email'] == 'user@university.edu'
+
+    assert google_certs.fetches == 1
+
+
+def test_decode_google_token_wrong_audience(google_certs):
+    """
+    It should reject Google tokens issued for another client.
+    """
+    with pytest.raises(ValueError):
+        Token.decode_google_token(google_token(audience='another-client'))
+
+
+def test_decode_token_cache(monkeypatch):
+    """
+    It should cache verified tokens and forget them when the secret rotates.
+    """
+    monkeypatch.setenv('JWT_SECRET', 'TEST_SECRET')
+    token = Token.generate_token({'email': 'user@university.edu'})
+    Token.decode_token(token)
+    hits = Token.token_cache.hits
+
+    assert Token.decode_token(token)['email'] == 'user@university.edu'
+    assert Token.token_cache.hits == hits + 1
+
+    monkeypatch.setenv('JWT_SECRET', 'ROTATED_SECRET')
+    with pytest.raises(HTTPException) as error:
+        Token.decode_token(token)
+    assert error.value.status_code == 400
+
+
+def test_decode_token_cache_expiry(monkeypatch):
+    """
+    It should stop accepting cached tokens once they expire.
+    """
+    monkeypatch.setenv('JWT_SECRET', 'TEST_SECRET')
+    token = jwt.encode({'email': 'user@university.edu', 'exp': time.time() + 1},
+                       'TEST_SECRET', 'HS256')
+    Token.decode_token(token)
+    time.sleep(1.1)
+
+    with pytest.raises(HTTPException) as error:
+        Token.decode_token(token)
+    assert error.value.status_code == 401
+
+
+def write_key(directory, kid, private_key):
+    """Writes a private key as `<kid>.pem`."""
+    (directory / f'{kid}.pem').write_bytes(private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()))
+
+
+@pytest.mark.parametrize('algorithm, generate_key', [
+    ('ES256', lambda: ec.generate_private_key(ec.SECP256R1())),
+    ('EdDSA', ed25519.Ed25519PrivateKey.generate)
+])
+def test_asymmetric_signing(monkeypatch, tmp_path, algorithm, generate_key):
+    """
+    It should sign tokens with the newest key and publish every key in the JWKS.
+    """
+    write_key(tmp_path, '2024-01', generate_key())
+    monkeypatch.setenv('JWT_ALGORITHM', algorithm)
+    monkeypatch.setenv('JWT_KEYS_DIR', str(tmp_path))
+    monkeypatch.setattr(Token, 'key_ring', None)
+    old_token = Token.generate_token({'email': 'user@university.edu'})
+
+    write_key(tmp_path, '2024-02', generate_key())
+    monkeypatch.setattr(Token, 'key_ring', None)
+    new_token = Token.generate_token({'email': 'user@university.edu'})
+
+    assert jwt.get_unverified_header(new_token)['kid'] == '2024-02'
+    assert Token.decode_token(old_token)['email'] == 'user@university.edu'
+
+    jwks = client.get('/.well-known/jwks.json').json()
+    assert [key['kid'] for key in jwks['keys']] == ['2024-01', '2024-02']
+
+    signing_key = jwt.PyJWKSet.from_dict(jwks)['2024-02']
+    payload = jwt.decode(new_token, signing_key.key, [algorithm])
+    assert payload['email'] == 'user@university.edu'
+
+
+def test_asymmetric_signing_unknown_key(monkeypatch, tmp_path):
+    """
+    It should reject tokens signed with a key that is not in the key ring.
+    """
+    monkeypatch.setenv('JWT_ALGORITHM', 'ES256')
+    monkeypatch.setattr(Token, 'key_ring', KeyRing(
+        'ES256', {'current': ec.generate_private_key(ec.SECP256R1())}, 'current'))
+    token = jwt.encode({'email': 'user@university.edu'},
+                       ec.generate_private_key(ec.SECP256R1()), 'ES256',
+                       headers={'kid': 'retired'})
+
+    with pytest.raises(HTTPException) as error:
+        Token.decode_token(token)
+    assert error.value.status_code == 400
+
+
+def test_generate_token_with_encoded_payload(monkeypatch):
+    """
+    It should sign an already encoded payload like the payload it encodes.
+    """
+    monkeypatch.setenv('JWT_SECRET', 'TEST_SECRET_WITH_AT_LEAST_32_BYTES')
+    payload = {'email': 'member@university.edu', 'roles': ['member'],
+               'authorizations': {'can_do_x': True, '_read': [], '_write': []}}
+
+    token = Token.generate_token(payload, dumps(payload))
+
+    decoded = Token.decode_token(token)
+    assert decoded['exp'] > time.time()
+    assert {key: decoded[key] for key in payload} == payload
+    assert encode_object({'token': token, 'payload': dumps(payload)}) == json.dumps(
+        {'token': token, 'payload': payload}, separators=(',', ':')).encode()
@@ -0,0 +1,157 @@
+"""
+In-process caches used to avoid repeated database and token work.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe, size-bounded LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        """
+        Parameters:
+            maxsize: The maximum number of entries. A size of 0 disables the cache.
+            ttl: The default number of seconds an entry stays valid.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        # The token of the fill started for each key, until it ends or a
+        # write to the key cancels it.
+        self.__fills = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key, default=None):
+        """
+        Gets a value from the cache, marking it as recently used.
+
+        Parameters:
+            key: The key of the entry.
+            default: The value returned if the entry is missing or expired.
+
+        Returns:
+            The cached value, or the default.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.__entries[key]
+                self.misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Adds a value to the cache, evicting the least recently used entry
+        if the cache is full.
+
+        Parameters:
+            key: The key of the entry.
+            value: The value to cache.
+            ttl: The number of seconds this entry stays valid. Defaults to
+                the cache's TTL.
+        """
+        if self.maxsize <= 0:
+            return
+
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+
+        with self.__lock:
+            self.__fills.pop(key, None)
+            self.__store(key, value, ttl)
+
+    def __store(self, key, value, ttl: float):
+        self.__entries[key] = (time.monotonic() + ttl, value)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.maxsize:
+            self.__entries.popitem(last=False)
+
+    def start_fill(self, key) -> object:
+        """
+        Starts filling an entry with a value that is about to be read.
+
+        Parameters:
+            key: The key of the entry.
+
+        Returns:
+            A token to pass to `fill`.
+        """
+        token = object()
+        with self.__lock:
+            self.__fills[key] = token
+        return token
+
+    def fill(self, key, token: object, value):
+        """
+        Ends a fill, adding the value read unless the entry was set or
+        invalidated since the fill started, so a value read before a write
+        cannot replace the write's value or undo its invalidation.
+
+        Parameters:
+            key: The key of the entry.
+            token: The token returned by `start_fill`.
+            value: The value read. None ends the fill without adding a value.
+
+        Returns:
+            Whether the value was added.
+        """
+        with self.__lock:
+            if self.__fills.get(key) is not token:
+                return False
+            del self.__fills[key]
+            if value is None or self.maxsize <= 0 or self.ttl <= 0:
+                return False
+            self.__store(key, value, self.ttl)
+            return True
+
+    def invalidate(self, key):
+        """
+        Removes an entry from the cache, if it exists.
+
+        Parameters:
+            key: The key of the entry.
+        """
+        with self.__lock:
+            self.__fills.pop(key, None)
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self.__lock:
+            self.__fills.clear()
+            self.__entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Reports counters that can be used to size the cache.
+
+        Returns:
+            The hit and miss counts, hit ratio, and current and maximum size.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self.__entries),
+            'maxsize': self.maxsize
+        }
@@ -0,0 +1,92 @@
+"""
+A compact claim format that shrinks the payload of tokens.
+
+Compact claims use short keys and store every role name once, in a table
+that the account's roles and its `_read` and `_write` lists refer to by
+index. The claims can also be deflated into a single base64 string.
+"""
+
+import base64
+import json
+import zlib
+
+COMPACT_VERSION = 1
+
+# Claims the JWT library verifies, which always stay readable.
+REGISTERED_CLAIMS = ('exp', 'iat', 'nbf')
+
+
+def compact_claims(payload: dict, deflate: bool = False) -> dict:
+    """
+    Converts a token payload into compact claims.
+
+    Parameters:
+        payload: The token payload, with 'email', 'roles' and 'authorizations'.
+        deflate: Whether to compress the claims.
+
+    Returns:
+        The compact claims.
+    """
+    claims = dict(payload)
+    email = claims.pop('email', None)
+    roles = list(claims.pop('roles', None) or [])
+    authorizations = dict(claims.pop('authorizations', None) or {})
+    read_roles = authorizations.pop('_read', [])
+    write_roles = authorizations.pop('_write', [])
+
+    role_table = list(dict.fromkeys([*roles, *read_roles, *write_roles]))
+    role_indexes = {role: index for index, role in enumerate(role_table)}
+
+    claims.update({
+        'e': email,
+        't': role_table,
+        'r': len(roles),
+        'a': authorizations,
+        'rd': [role_indexes[role] for role in read_roles],
+        'wr': [role_indexes[role] for role in write_roles]
+    })
+
+    if deflate:
+        registered = {key: claims.pop(key)
+                      for key in REGISTERED_CLAIMS if key in claims}
+        data = zlib.compress(json.dumps(claims, separators=(',', ':')).encode(), 9)
+        claims = {'z': base64.urlsafe_b64encode(data).rstrip(b'=').decode(),
+                  **registered}
+
+    claims['c'] = COMPACT_VERSION
+    return claims
+
+
+def expand_claims(claims: dict) -> dict:
+    """
+    Converts compact claims back into a token payload. Claims that are not
+    compact are returned unchanged.
+
+    Parameters:
+        claims: The decoded claims of a token.
+
+    Returns:
+        The token payload.
+    """
+    if claims.get('c') != COMPACT_VERSION:
+        return claims
+
+    claims = dict(claims)
+    claims.pop('c')
+    if 'z' in claims:
+        data = claims.pop('z')
+        data = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+        claims.update(json.loads(zlib.decompress(data)))
+
+    role_table = claims.pop('t')
+    authorizations = claims.pop('a')
+    authorizations['_read'] = [role_table[index] for index in claims.pop('rd')]
+    authorizations['_write'] = [role_table[index] for index in claims.pop('wr')]
+
+    payload = {
+        'email': claims.pop('e'),
+        'roles': role_table[:claims.pop('r')],
+        'authorizations': authorizations
+    }
+    payload.update(claims)
+    return payload
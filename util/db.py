@@ -2,151 +2,882 @@
 CRUD functions for the database.
 """
 
+import asyncio
+import hashlib
+import json
+import logging
 import os
-from pymongo import MongoClient
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from pymongo import (ASCENDING, AsyncMongoClient, DeleteOne, IndexModel,
+                     MongoClient, ReplaceOne, ReturnDocument, UpdateOne)
+from pymongo.errors import (BulkWriteError, ConnectionFailure, DuplicateKeyError,
+                            OperationFailure, PyMongoError)
+from pymongo.monitoring import ConnectionPoolListener
+from util.cache import LRUCache
+from util.metrics import DB_LATENCY, timed
+from util.permissions import Authorizations, permission_bits
+from util.storage import AuthStorage, authz_version
 
+logger = logging.getLogger(__name__)
 
-class AuthDB:
-    """Helper class for database functions."""
-    account_collection = None
-    role_collection = None
+MAX_RESOLVED_ROLE_SETS = 10000
 
-    @classmethod
-    def __setup_database(cls):
-        """Gets 'accounts' and 'roles' collections from MongoDB."""
-        if cls.account_collection is None or cls.role_collection is None:
-            client = MongoClient(os.getenv('MONGODB_URL'))
-            cls.account_collection = client['Accounts'].get_collection(
-                'accounts')
-            cls.role_collection = client['Accounts'].get_collection(
-                'roles')
+# The code of the write error MongoDB reports for a unique index violation.
+DUPLICATE_KEY_ERROR = 11000
 
-    @classmethod
-    def get_account_by_email(cls, email: str) -> dict:
+# The number of seconds before a failed setup is retried. The delay doubles
+# with each consecutive failure, up to the maximum.
+SETUP_RETRY_MIN_DELAY = 1
+SETUP_RETRY_MAX_DELAY = 30
+
+ACCOUNT_INDEXES = [
+    IndexModel([('email', ASCENDING)], unique=True),
+    # Multikey index that also returns accounts with a role in email order.
+    IndexModel([('roles', ASCENDING), ('email', ASCENDING)])
+]
+ROLE_INDEXES = [
+    IndexModel([('name', ASCENDING)], unique=True)
+]
+REVOKED_TOKEN_INDEXES = [
+    IndexModel([('jti', ASCENDING)], unique=True),
+    IndexModel([('revoked_at', ASCENDING)]),
+    # Removes a record once every token with the ID has expired.
+    IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0)
+]
+RESOLVED_ACCOUNT_INDEXES = [
+    IndexModel([('email', ASCENDING)], unique=True),
+    IndexModel([('roles', ASCENDING), ('email', ASCENDING)])
+]
+
+
+def role_fingerprint(role_documents: list[dict]) -> str:
+    """
+    Fingerprints role documents, so any edit to a role changes the
+    authorization versions of the accounts that have it.
+
+    Parameters:
+        role_documents: The role documents, with None for missing roles.
+
+    Returns:
+        A short hexadecimal digest.
+    """
+    data = json.dumps(role_documents, sort_keys=True, default=str)
+    return hashlib.blake2b(data.encode(), digest_size=4).hexdigest()
+
+
+class RoleCache:
+    """
+    An in-memory snapshot of every role document.
+
+    The snapshot is kept up to date by a change stream on the roles
+    collection. Deployments without a replica set cannot open change
+    streams, so the snapshot is reloaded on an interval instead.
+    """
+
+    def __init__(self, collection, poll_interval: float = 30):
+        """
+        Parameters:
+            collection: The roles collection, or any object with the same
+                `find` method. Objects without a `watch` method are polled.
+            poll_interval: The number of seconds between reloads when change
+                streams are not available.
+        """
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.listeners = []
+        # Whether a load has succeeded, so the snapshot can be trusted.
+        self.loaded = False
+        # The role documents and the authorizations resolved from them are
+        # swapped together, so a resolution is never cached against a stale
+        # snapshot.
+        self.__snapshot = ({}, {})
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    @property
+    def roles(self) -> dict[str, dict]:
+        """The role documents, by name."""
+        return self.__snapshot[0]
+
+    def load(self):
+        """Reloads every role document, notifying listeners if anything changed."""
+        roles = {data['name']: data
+                 for data in self.collection.find({}, {'_id': 0})}
+
+        changed = roles != self.roles
+        self.loaded = True
+        if changed:
+            self.__snapshot = (roles, {})
+            for listener in self.listeners:
+                listener()
+
+    def start(self):
+        """Loads the roles, then keeps them in sync from a background thread."""
+        self.load()
+        if self.__thread is None:
+            self.__stopped.clear()
+            self.__thread = threading.Thread(target=self.__sync,
+                                             name='role-cache',
+                                             daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        """Stops the background thread."""
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __sync(self):
+        """Follows the change stream, falling back to polling."""
+        if not hasattr(self.collection, 'watch'):
+            self.__poll()
+            return
+        while not self.__stopped.is_set():
+            try:
+                with self.collection.watch(max_await_time_ms=1000) as stream:
+                    # Reload after the stream is open so no change is missed.
+                    self.load()
+                    while not self.__stopped.is_set():
+                        if stream.try_next() is not None:
+                            self.load()
+            except OperationFailure:
+                logger.info('Change streams are unavailable. Polling roles '
+                            'every %s seconds.', self.poll_interval)
+                self.__poll()
+            except PyMongoError:
+                logger.exception('Lost the roles change stream. Retrying.')
+                self.__stopped.wait(self.poll_interval)
+
+    def __poll(self):
+        """Reloads the roles on an interval until stopped."""
+        while not self.__stopped.wait(self.poll_interval):
+            try:
+                self.load()
+            except Exception:
+                logger.exception('Could not reload roles.')
+
+    def resolve(self, role_names: list[str]) -> dict:
         """
-        Finds an account from the mongo database given an email address.
+        Merges the authorizations of the given roles. Accounts tend to share
+        a few combinations of roles, so each combination is merged once per
+        snapshot and the result is shared; it must not be modified.
 
         Parameters:
-            email: The email address of the account.
+            role_names: The names of the roles.
 
         Returns:
-            The account data.
-        """
-        cls.__setup_database()
-
-        account_data: dict = cls.account_collection.find_one({'email': email})
-
-        if account_data is not None:
-            authorization_data: list[dict] = cls.role_collection.find(
-                {'name': {'$in': account_data.get('roles', [])}})
-
-            authorizations = {}
-            read_roles = []
-            write_roles = []
-            for data in authorization_data:
-                data_read_roles = data.get('authorizations', {}).get('_read', [])
-                data_write_roles = data.get('authorizations', {}).get('_write', [])
-                data['authorizations'].pop('_read')
-                data['authorizations'].pop('_write')
-                data.pop('_id')
-                authorizations.update(data['authorizations'])
-                read_roles = read_roles + data_read_roles
-                write_roles = write_roles + data_write_roles
-
-            account_data.pop('_id')
-            authorizations['_read'] = read_roles
-            authorizations['_write'] = write_roles
-            account_data['authorizations'] = authorizations
+            The merged authorizations, including the `_read` and `_write` lists.
+        """
+        roles, resolved = self.__snapshot
+        key = tuple(role_names)
+        authorizations = resolved.get(key)
+        if authorizations is None:
+            authorizations = self.__merge(roles, key)
+            if len(resolved) < MAX_RESOLVED_ROLE_SETS:
+                resolved[key] = authorizations
 
-        return account_data
+        return authorizations
 
-    @classmethod
-    def get_accounts_by_role(cls, value: str) -> list[dict]:
+    @staticmethod
+    def __merge(roles: dict[str, dict], role_names: tuple[str]) -> dict:
+        """
+        Merges the authorizations of the given roles from a snapshot and
+        compiles their permission bitset.
         """
-        Finds all accounts from the mongo database that have a given
-        authorization.
+        authorizations = Authorizations()
+        read_roles = []
+        write_roles = []
+        for name in dict.fromkeys(role_names):
+            data = roles.get(name)
+            if data is None:
+                continue
+            role_authorizations = data.get('authorizations', {})
+            for key, value in role_authorizations.items():
+                if key == '_read':
+                    read_roles.extend(value)
+                elif key == '_write':
+                    write_roles.extend(value)
+                else:
+                    authorizations[key] = value
+
+        authorizations['_read'] = read_roles
+        authorizations['_write'] = write_roles
+        authorizations.bits = permission_bits.compile(authorizations)
+        authorizations.version = role_fingerprint(
+            [roles.get(name) for name in dict.fromkeys(role_names)])
+        return authorizations
+
 
+class PoolStats(ConnectionPoolListener):
+    """Counts the open and checked out connections of a MongoDB client."""
+
+    def __init__(self, max_pool_size: int):
+        """
         Parameters:
-            key: The key in the user's authorization data to test.
-            value: The value which will be true for all returned accounts.
+            max_pool_size: The maximum size of the connection pool.
+        """
+        self.max_pool_size = max_pool_size
+        self.open = 0
+        self.checked_out = 0
+        self.__lock = threading.Lock()
+
+    def __count(self, attribute: str, change: int):
+        with self.__lock:
+            setattr(self, attribute, getattr(self, attribute) + change)
+
+    def connection_created(self, event):
+        self.__count('open', 1)
+
+    def connection_closed(self, event):
+        self.__count('open', -1)
+
+    def connection_checked_out(self, event):
+        self.__count('checked_out', 1)
+
+    def connection_checked_in(self, event):
+        self.__count('checked_out', -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def report(self) -> dict:
+        """
+        Reports the pool's size and utilization.
 
         Returns:
-            All accounts with the given authorization.
-        """
-        cls.__setup_database()
-
-        account_data: list[dict] = cls.account_collection.aggregate([
-            {
-                '$match': {'roles': value}
-            },
-            {
-                '$lookup': {
-                    'from': 'roles',
-                    'localField': 'roles',
-                    'foreignField': 'name',
-                    'as': 'authorizations'
-                }
-            }
-        ])
-
-        transformed_account_data = []
-        for data in account_data:
-            authorizations = {}
-            read_roles = []
-            write_roles = []
-            for auth in data['authorizations']:
-                data_read_roles = auth.get('authorizations', {}).get('_read', [])
-                data_write_roles = auth.get('authorizations', {}).get('_write', [])
-                auth['authorizations'].pop('_read')
-                auth['authorizations'].pop('_write')
-                authorizations.update(auth.get('authorizations', {}))
-                read_roles = read_roles + data_read_roles
-                write_roles = write_roles + data_write_roles
-
-            data.pop('_id')
-            authorizations['_read'] = read_roles
-            authorizations['_write'] = write_roles
-            data['authorizations'] = authorizations
-            transformed_account_data.append(data)
-
-        return transformed_account_data
-
-    @classmethod
-    def update_account(cls, account: dict):
-        """
-        Updates an account in the database.
+            The open and checked out connections, the maximum pool size, and
+            the fraction of the pool that is checked out.
+        """
+        return {
+            'open': self.open,
+            'checked_out': self.checked_out,
+            'max_size': self.max_pool_size,
+            'utilization': self.checked_out / self.max_pool_size
+        }
 
-        Parameters:
-            account: The account data.
+
+def mongo_client_options() -> dict:
+    """
+    Reads the MongoDB client settings from the environment. Settings that
+    are not set keep the driver's defaults.
+
+    Returns:
+        The keyword arguments for MongoClient and AsyncMongoClient.
+    """
+    options = {
+        'maxPoolSize': int(os.getenv('MONGODB_MAX_POOL_SIZE', '100')),
+        'minPoolSize': int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+    }
+    settings = {
+        'connectTimeoutMS': 'MONGODB_CONNECT_TIMEOUT_MS',
+        'socketTimeoutMS': 'MONGODB_SOCKET_TIMEOUT_MS',
+        'serverSelectionTimeoutMS': 'MONGODB_SERVER_SELECTION_TIMEOUT_MS'
+    }
+    for option, variable in settings.items():
+        if os.getenv(variable):
+            options[option] = int(os.getenv(variable))
+    if os.getenv('MONGODB_READ_CONCERN'):
+        options['readConcernLevel'] = os.getenv('MONGODB_READ_CONCERN')
+    return options
+
+
+_account_cache = None
+_role_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_account_cache() -> LRUCache:
+    """Gets the resolved-account cache shared by the storage backends."""
+    global _account_cache
+    with _cache_lock:
+        if _account_cache is None:
+            _account_cache = LRUCache(
+                maxsize=int(os.getenv('ACCOUNT_CACHE_SIZE', '4096')),
+                ttl=float(os.getenv('ACCOUNT_CACHE_TTL', '60')))
+        return _account_cache
+
+
+def get_role_cache(role_collection=None) -> RoleCache:
+    """
+    Gets the role snapshot of the MongoDB backend, starting it on first
+    use. The snapshot is only shared once its first load
+    succeeds, so a failed load, such as when MongoDB is unreachable at
+    startup, is retried by the next call instead of leaving an empty
+    snapshot behind. The first call blocks on that load.
+
+    Parameters:
+        role_collection: A synchronous 'roles' collection to follow. One is
+            created if it is not given.
+    """
+    global _role_cache
+    account_cache = get_account_cache()
+    with _cache_lock:
+        if _role_cache is None:
+            client = None
+            if role_collection is None:
+                client = MongoClient(os.getenv('MONGODB_URL'),
+                                     **mongo_client_options())
+                role_collection = client['Accounts'].get_collection('roles')
+            role_cache = RoleCache(
+                role_collection,
+                poll_interval=float(os.getenv('ROLE_CACHE_POLL_INTERVAL', '30')))
+            role_cache.listeners.append(account_cache.clear)
+            try:
+                role_cache.start()
+            except Exception:
+                if client is not None:
+                    client.close()
+                raise
+            _role_cache = role_cache
+        return _role_cache
+
+
+def accounts_by_role_query(role: str, after: str = None) -> dict:
+    """
+    Builds the query for accounts with a role. Results are paged by email
+    address, which the (roles, email) index serves in order.
+
+    Parameters:
+        role: The role which all matched accounts will have.
+        after: Only accounts with an email address after this one match.
+
+    Returns:
+        The query.
+    """
+    query = {'roles': role}
+    if after is not None:
+        query['email'] = {'$gt': after}
+    return query
+
+
+def role_update_operations(updates: list[dict]) -> list:
+    """
+    Builds the bulk write operations that add and remove roles, one atomic
+    upsert per update, built by `account_role_update`.
+
+    Parameters:
+        updates: Dictionaries with 'email', 'add_roles' and 'remove_roles'.
+
+    Returns:
+        The operations, in the order of the updates.
+    """
+    return [UpdateOne({'email': update['email']},
+                      account_role_update(update.get('add_roles', []),
+                                          update.get('remove_roles', [])),
+                      upsert=True)
+            for update in updates]
+
+
+def account_role_update(add_roles: list[str], remove_roles: list[str]):
+    """
+    Builds the update that adds and removes roles on one account and
+    increments its 'authz_version'. Adding roles is a plain `$addToSet`;
+    MongoDB rejects `$addToSet` and `$pull` on the same field in one
+    update, so removing roles is an update pipeline that does both, in the
+    order of `apply_role_update`. Either way the account is written
+    atomically.
+
+    Parameters:
+        add_roles: The roles to add.
+        remove_roles: The roles to remove.
+
+    Returns:
+        The update document or pipeline.
+    """
+    add_roles = list(dict.fromkeys(add_roles))
+    remove_roles = [role for role in dict.fromkeys(remove_roles)
+                    if role not in add_roles]
+
+    if not remove_roles:
+        return {'$addToSet': {'roles': {'$each': add_roles}},
+                '$inc': {'authz_version': 1}}
+
+    # Roles are wrapped in $literal, so names starting with $ are not read
+    # as field paths.
+    return [{'$set': {
+        'roles': {'$let': {
+            'vars': {'roles': {'$ifNull': ['$roles', []]}},
+            'in': {'$concatArrays': [
+                {'$filter': {'input': '$$roles',
+                             'cond': {'$not': [{'$in': ['$$this',
+                                                        {'$literal': remove_roles}]}]}}},
+                {'$filter': {'input': {'$literal': add_roles},
+                             'cond': {'$not': [{'$in': ['$$this', '$$roles']}]}}}
+            ]}
+        }},
+        'authz_version': {'$add': [{'$ifNull': ['$authz_version', 0]}, 1]}
+    }}]
+
+
+def role_update_results(updates: list[dict], bulk_result: dict) -> list[dict]:
+    """
+    Reports the outcome of each update in a bulk write of the operations
+    built by `role_update_operations`.
+
+    Parameters:
+        updates: The updates that were written.
+        bulk_result: The raw bulk write result, or the details of a
+            BulkWriteError.
+
+    Returns:
+        One result per update, with a 'status' of 'created', 'updated' or 'error'.
+    """
+    results = [{'email': update['email'], 'status': 'updated'}
+               for update in updates]
+    for upserted in bulk_result.get('upserted', []):
+        results[upserted['index']]['status'] = 'created'
+    for write_error in bulk_result.get('writeErrors', []):
+        result = results[write_error['index']]
+        result['status'] = 'error'
+        result['error'] = write_error.get('errmsg')
+    return results
+
+
+def resolved_account(account_data: dict, role_cache: RoleCache) -> dict:
+    """
+    Builds the document stored in 'resolved_accounts' for an account.
+
+    Parameters:
+        account_data: The account document.
+        role_cache: The role snapshot to resolve the account's roles against.
+
+    Returns:
+        The account's email address, roles, merged authorizations and
+        authorization version, and the account's own numeric version, which
+        orders writes of the same account.
+    """
+    authorizations = role_cache.resolve(account_data.get('roles', []))
+    return {
+        'email': account_data['email'],
+        'roles': account_data.get('roles', []),
+        'authorizations': dict(authorizations),
+        'authz_version': authz_version(account_data, authorizations),
+        'account_version': account_data.get('authz_version', 0)
+    }
+
+
+def materialize_operations(emails: list[str], account_documents: list[dict],
+                           role_cache: RoleCache) -> list:
+    """
+    Builds the bulk write operations that bring 'resolved_accounts' up to
+    date for some accounts. A document is only replaced by one built from
+    the same or a newer version of the account, so a write that read the
+    account before a concurrent update cannot overwrite the newer document.
+    The upsert then fails on the unique index on email, which
+    `unexpected_write_errors` ignores.
+
+    Parameters:
+        emails: The email addresses of the accounts that were written.
+        account_documents: The current documents of those accounts. Accounts
+            without a document were deleted.
+        role_cache: The role snapshot.
+
+    Returns:
+        The operations.
+    """
+    operations = []
+    for account_data in account_documents:
+        document = resolved_account(account_data, role_cache)
+        # Documents written before account versions were stored match too.
+        operations.append(ReplaceOne(
+            {'email': document['email'],
+             'account_version': {'$not': {'$gt': document['account_version']}}},
+            document,
+            upsert=True))
+    found = {account_data['email'] for account_data in account_documents}
+    operations.extend(DeleteOne({'email': email})
+                      for email in dict.fromkeys(emails) if email not in found)
+    return operations
+
+
+def unexpected_write_errors(bulk_result: dict) -> list[dict]:
+    """
+    Gets the errors of a bulk write built by `materialize_operations`,
+    except the duplicate key errors of documents that a newer version of
+    the account has already replaced.
+
+    Parameters:
+        bulk_result: The details of the BulkWriteError.
+
+    Returns:
+        The write errors.
+    """
+    return [error for error in bulk_result.get('writeErrors', [])
+            if error.get('code') != DUPLICATE_KEY_ERROR]
+
+
+def hot_queries(account_collection) -> dict:
+    """
+    Builds cursors for the queries run on every request.
+
+    Parameters:
+        account_collection: The 'accounts' collection.
+
+    Returns:
+        The cursors, by a description of the query.
+    """
+    return {
+        'accounts by email': account_collection.find({'email': ''}),
+        'accounts by role': account_collection.find(
+            accounts_by_role_query('', '')).sort('email', 1)
+    }
+
+
+def uses_collection_scan(explanation: dict) -> bool:
+    """
+    Checks whether the winning plan of an explained query scans a whole
+    collection.
+
+    Parameters:
+        explanation: The output of `explain()`.
+
+    Returns:
+        Whether any stage of the plan is a COLLSCAN.
+    """
+    stages = [explanation.get('queryPlanner', {}).get('winningPlan', {})]
+    while stages:
+        stage = stages.pop()
+        if isinstance(stage, list):
+            stages.extend(stage)
+        elif isinstance(stage, dict):
+            if stage.get('stage') == 'COLLSCAN':
+                return True
+            stages.extend(stage.values())
+    return False
+
+
+def check_query_plans(collection_scans: dict[str, bool], fail: bool = False):
+    """
+    Reports queries that scan whole collections.
+
+    Parameters:
+        collection_scans: Whether each query scans a whole collection, by
+            a description of the query.
+        fail: Whether to raise an error instead of logging one.
+    """
+    scanning_queries = [query for query, scans in collection_scans.items()
+                        if scans]
+    if not scanning_queries:
+        return
+
+    message = ('These queries scan whole collections: '
+               f'{", ".join(scanning_queries)}. Check the indexes on the '
+               'accounts collection.')
+    if fail:
+        raise RuntimeError(message)
+    logger.error(message)
+
+
+class AsyncAuthDB(AuthStorage):
+    """The MongoDB storage backend, on the asynchronous driver."""
+    client = None
+    account_collection = None
+    role_collection = None
+    revoked_token_collection = None
+    # Set when MATERIALIZE_ACCOUNTS is 'true'.
+    resolved_account_collection = None
+    # Serializes setups on the event loop it was created on.
+    __setup_lock = None
+    __setup_loop = None
+    # Consecutive failed setups, and when the next one may be tried.
+    __setup_failures = 0
+    __setup_retry_at = 0
+
+    @classmethod
+    async def setup(cls):
+        """
+        Gets 'accounts' and 'roles' collections from MongoDB. The collections
+        are only kept once provisioning and the first role load succeed, so
+        a failed setup is retried. Concurrent calls wait for one setup
+        instead of each building a client, and after a failure, calls fail
+        fast until the retry delay has passed.
         """
-        cls.__setup_database()
+        if cls.account_cache is None:
+            cls.account_cache = get_account_cache()
+        if cls.__is_set_up():
+            return
+
+        async with cls.__lock():
+            if cls.__is_set_up():
+                return
+            now = time.monotonic()
+            if now < cls.__setup_retry_at:
+                raise ConnectionFailure(
+                    'MongoDB setup failed. It will be retried in '
+                    f'{cls.__setup_retry_at - now:.1f} seconds.')
+            try:
+                await cls.__set_up()
+            except Exception:
+                cls.__setup_failures += 1
+                delay = min(SETUP_RETRY_MIN_DELAY * 2 ** (cls.__setup_failures - 1),
+                            SETUP_RETRY_MAX_DELAY)
+                cls.__setup_retry_at = time.monotonic() + delay
+                raise
+            cls.__setup_failures = 0
+            cls.__setup_retry_at = 0
+
+    @classmethod
+    def __is_set_up(cls) -> bool:
+        return cls.account_collection is not None and cls.role_cache is not None
+
+    @classmethod
+    def __lock(cls) -> asyncio.Lock:
+        """Gets the setup lock of the running event loop."""
+        loop = asyncio.get_running_loop()
+        if cls.__setup_loop is not loop:
+            cls.__setup_lock = asyncio.Lock()
+            cls.__setup_loop = loop
+        return cls.__setup_lock
+
+    @classmethod
+    async def __set_up(cls):
+        """Connects, provisions and loads the roles, then keeps the collections."""
+        options = mongo_client_options()
+        pool_stats = PoolStats(options['maxPoolSize'])
+        client = AsyncMongoClient(os.getenv('MONGODB_URL'),
+                                  event_listeners=[pool_stats],
+                                  **options)
+        database = client['Accounts']
+        resolved_account_collection = None
+        if os.getenv('MATERIALIZE_ACCOUNTS', 'false') == 'true':
+            resolved_account_collection = database.get_collection(
+                'resolved_accounts')
+        try:
+            await cls.__provision(database, resolved_account_collection)
+            # The first load is a blocking query, so it runs off the event loop.
+            role_cache = await asyncio.to_thread(get_role_cache)
+        except BaseException:
+            await client.close()
+            raise
 
-        account_copy = account.copy()
-        if account_copy.get('authorizations', False):
-            account_copy.pop('authorizations')
+        cls.pool_stats = pool_stats
+        cls.client = client
+        cls.account_collection = database.get_collection('accounts')
+        cls.role_collection = database.get_collection('roles')
+        cls.revoked_token_collection = database.get_collection('revoked_tokens')
+        cls.resolved_account_collection = resolved_account_collection
+        cls.role_cache = role_cache
 
-        return cls.account_collection.update_one({
-            'email': account_copy['email']},
-            {'$set': account_copy})
+    @classmethod
+    async def connect(cls):
+        """
+        Connects to MongoDB before the first request: ensures the indexes,
+        opens MONGODB_MIN_POOL_SIZE connections (at least one) and loads
+        the role snapshot.
+        """
+        await cls.setup()
+        connections = max(mongo_client_options()['minPoolSize'], 1)
+        await asyncio.gather(*(cls.ping() for _ in range(connections)))
 
     @classmethod
-    def delete_account(cls, account: dict):
+    @timed(DB_LATENCY)
+    async def ping(cls) -> float:
         """
-        Deletes an account from the mongo database.
+        Pings the database.
 
-        Parameters:
-            account: The account data.
+        Returns:
+            The round trip time in seconds.
         """
-        cls.__setup_database()
-        return cls.account_collection.delete_one({'email': account['email']})
+        await cls.setup()
+        start = time.perf_counter()
+        await cls.client.admin.command('ping')
+        return time.perf_counter() - start
 
     @classmethod
-    def create_account(cls, account_data: dict):
+    async def __provision(cls, database, resolved_account_collection=None):
         """
-        Creates an account in the mongo database.
+        Ensures the indexes exist unless DB_ENSURE_INDEXES is 'false', and
+        checks the query plans when DB_QUERY_PLAN_CHECK is 'warn' or 'fail'.
+        """
+        if os.getenv('DB_ENSURE_INDEXES', 'true') != 'false':
+            await cls.__create_indexes(database, resolved_account_collection)
+
+        query_plan_check = os.getenv('DB_QUERY_PLAN_CHECK', 'off')
+        if query_plan_check != 'off':
+            check_query_plans(
+                await cls.__explain(database.get_collection('accounts')),
+                fail=query_plan_check == 'fail')
+
+    @classmethod
+    async def __create_indexes(cls, database, resolved_account_collection=None):
+        """
+        Creates the indexes the queries rely on, including a unique index on
+        account email addresses. Existing indexes are left as they are.
+        """
+        try:
+            await database.get_collection('accounts').create_indexes(ACCOUNT_INDEXES)
+            await database.get_collection('roles').create_indexes(ROLE_INDEXES)
+            await database.get_collection('revoked_tokens').create_indexes(
+                REVOKED_TOKEN_INDEXES)
+            if resolved_account_collection is not None:
+                await resolved_account_collection.create_indexes(
+                    RESOLVED_ACCOUNT_INDEXES)
+        except OperationFailure:
+            logger.exception('Could not create the database indexes. Queries '
+                             'may scan whole collections.')
+
+    @classmethod
+    async def __explain(cls, account_collection) -> dict[str, bool]:
+        """Explains the queries run on every request, by whether each scans a whole collection."""
+        return {query: uses_collection_scan(await cursor.explain())
+                for query, cursor in hot_queries(account_collection).items()}
+
+    @classmethod
+    async def __materialize(cls, emails: list[str], account_documents: list[dict] = None):
+        """
+        Updates 'resolved_accounts' for accounts that were written, when
+        MATERIALIZE_ACCOUNTS is 'true'. The account write has already
+        committed, so failures are logged rather than raised, and the
+        documents are left for `python -m util.materialize verify` to find.
 
-        Parameters
-            account_data: The account data.
+        Parameters:
+            emails: The email addresses of the accounts.
+            account_documents: The accounts' current documents, if the write
+                returned them. Otherwise they are read.
         """
-        cls.__setup_database()
-        return cls.account_collection.insert_one(account_data)
+        if cls.resolved_account_collection is None or not emails:
+            return
+        try:
+            if account_documents is None:
+                account_documents = await cls.account_collection.find(
+                    {'email': {'$in': list(emails)}}, {'_id': 0}).to_list()
+
+            await cls.resolved_account_collection.bulk_write(
+                materialize_operations(emails, account_documents, cls.role_cache),
+                ordered=False)
+        except BulkWriteError as e:
+            errors = unexpected_write_errors(e.details)
+            if errors:
+                logger.error('Could not update the resolved documents of %s: %s',
+                             emails, errors)
+        except PyMongoError:
+            logger.exception('Could not update the resolved documents of %s.', emails)
+
+    @classmethod
+    async def _find_account(cls, email: str) -> dict:
+        return await cls.account_collection.find_one({'email': email},
+                                                     {'_id': 0})
+
+    @classmethod
+    async def _find_or_insert_account(cls, account_data: dict) -> dict:
+        # One atomic upsert, so concurrent first logins cannot create
+        # duplicate accounts.
+        account_data = await cls.account_collection.find_one_and_update(
+            {'email': account_data['email']},
+            {'$setOnInsert': account_data},
+            projection={'_id': 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+        await cls.__materialize([account_data['email']], [account_data])
+        return account_data
+
+    @classmethod
+    async def _find_accounts_by_role(cls, role: str, after: str, limit: int):
+        cursor = cls.account_collection.find(accounts_by_role_query(role, after),
+                                             {'_id': 0}).sort('email', 1)
+        if limit:
+            cursor = cursor.limit(limit)
+
+        async for data in cursor:
+            yield data
+
+    @classmethod
+    async def _find_account_version(cls, email: str) -> dict:
+        return await cls.account_collection.find_one(
+            {'email': email}, {'_id': 0, 'roles': 1, 'authz_version': 1})
+
+    @classmethod
+    async def _update_account(cls, account_data: dict):
+        result = await cls.account_collection.update_one(
+            {'email': account_data['email']},
+            {'$set': account_data, '$inc': {'authz_version': 1}})
+        await cls.__materialize([account_data['email']])
+        return result
+
+    @classmethod
+    async def _update_account_roles(cls, email: str, add_roles: list[str],
+                                    remove_roles: list[str]) -> dict:
+        account_data = await cls.account_collection.find_one_and_update(
+            {'email': email},
+            account_role_update(add_roles, remove_roles),
+            projection={'_id': 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+        await cls.__materialize([email], [account_data])
+        return account_data
+
+    @classmethod
+    async def _update_roles(cls, updates: list[dict]) -> list[dict]:
+        # One unordered bulk write for every update.
+        operations = role_update_operations(updates)
+        try:
+            result = await cls.account_collection.bulk_write(operations,
+                                                             ordered=False)
+            bulk_result = result.bulk_api_result
+        except BulkWriteError as e:
+            bulk_result = e.details
+
+        await cls.__materialize([update['email'] for update in updates])
+        return role_update_results(updates, bulk_result)
+
+    @classmethod
+    async def _delete_account(cls, email: str):
+        result = await cls.account_collection.delete_one({'email': email})
+        await cls.__materialize([email])
+        return result
+
+    @classmethod
+    async def _insert_account(cls, account_data: dict):
+        result = await cls.account_collection.insert_one(account_data)
+        await cls.__materialize([account_data['email']])
+        return result
+
+    @classmethod
+    async def _insert_revoked_token(cls, jti: str, expires_at: float,
+                                    revoked_at: float) -> bool:
+        try:
+            await cls.revoked_token_collection.insert_one({
+                'jti': jti,
+                'expires_at': datetime.fromtimestamp(expires_at, tz=timezone.utc),
+                'revoked_at': datetime.fromtimestamp(revoked_at, tz=timezone.utc)
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+    @classmethod
+    async def _find_revoked_tokens(cls, since: float, prefix: str) -> list[dict]:
+        query = {
+            'revoked_at': {'$gte': datetime.fromtimestamp(since, tz=timezone.utc)},
+            'expires_at': {'$gt': datetime.now(tz=timezone.utc)}
+        }
+        if prefix:
+            query['jti'] = {'$regex': '^' + re.escape(prefix)}
+        cursor = cls.revoked_token_collection.find(query, {'_id': 0})
+        # The driver returns naive datetimes in UTC.
+        return [{'jti': data['jti'],
+                 'expires_at': data['expires_at'].replace(tzinfo=timezone.utc).timestamp(),
+                 'revoked_at': data['revoked_at'].replace(tzinfo=timezone.utc).timestamp()}
+                async for data in cursor]
@@ -0,0 +1,127 @@
+"""
+A cache of the certificates Google uses to sign Identity Services tokens.
+"""
+
+import logging
+import re
+import threading
+import time
+import requests
+from cryptography.x509 import load_pem_x509_certificate
+from jwt import PyJWKSet
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+
+
+class GoogleCerts:
+    """
+    Holds Google's public signing keys in memory for as long as the
+    `Cache-Control` max-age of the certificate endpoint allows.
+
+    Keys are refreshed in the background shortly before they expire, so
+    verifying a token normally makes no outbound request.
+    """
+
+    def __init__(self,
+                 url: str = GOOGLE_CERTS_URL,
+                 refresh_margin: float = 300,
+                 default_max_age: float = 300,
+                 min_fetch_interval: float = 30,
+                 timeout: float = 10):
+        """
+        Parameters:
+            url: The certificate endpoint. It may return either
+                `{key id: x509 certificate}` or a JWK Set.
+            refresh_margin: The number of seconds before expiry at which the
+                keys are refreshed in the background. Short-lived keys are
+                refreshed halfway through their lifetime instead.
+            default_max_age: The number of seconds keys are kept when the
+                response has no max-age.
+            min_fetch_interval: The minimum number of seconds between
+                downloads triggered by unknown key IDs.
+            timeout: The number of seconds to wait for the endpoint.
+        """
+        self.url = url
+        self.refresh_margin = refresh_margin
+        self.default_max_age = default_max_age
+        self.min_fetch_interval = min_fetch_interval
+        self.timeout = timeout
+        self.fetches = 0
+        self.__session = requests.Session()
+        self.__keys = {}
+        self.__expires_at = 0
+        self.__refresh_at = 0
+        self.__fetched_at = float('-inf')
+        self.__lock = threading.Lock()
+        self.__refresh_lock = threading.Lock()
+
+    def fetch(self):
+        """Downloads the keys and records when they expire."""
+        response = self.__session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        self.fetches += 1
+
+        max_age = re.search(r'max-age=(\d+)',
+                            response.headers.get('Cache-Control', ''))
+        max_age = int(max_age.group(1)) if max_age else self.default_max_age
+
+        certs = response.json()
+        if 'keys' in certs:
+            keys = {key.key_id: key.key
+                    for key in PyJWKSet.from_dict(certs).keys}
+        else:
+            keys = {key_id: load_pem_x509_certificate(cert.encode()).public_key()
+                    for key_id, cert in certs.items()}
+
+        self.__keys = keys
+        self.__fetched_at = time.monotonic()
+        self.__expires_at = self.__fetched_at + max_age
+        self.__refresh_at = self.__fetched_at + max(max_age - self.refresh_margin,
+                                                    max_age / 2)
+
+    def get_key(self, key_id: str):
+        """
+        Gets a public key by its key ID. Keys are downloaded if they have
+        expired or the key ID is unknown, which happens when Google rotates
+        its keys.
+
+        Parameters:
+            key_id: The `kid` header of the token.
+
+        Returns:
+            The public key, or None if Google does not publish it.
+        """
+        if self.__needs_fetch(key_id):
+            with self.__lock:
+                if self.__needs_fetch(key_id):
+                    self.fetch()
+        elif time.monotonic() >= self.__refresh_at:
+            self.__refresh_in_background()
+
+        return self.__keys.get(key_id)
+
+    def __needs_fetch(self, key_id: str) -> bool:
+        """Checks whether the keys have expired or may be missing a new key."""
+        now = time.monotonic()
+        if now >= self.__expires_at:
+            return True
+        return (key_id not in self.__keys
+                and now - self.__fetched_at >= self.min_fetch_interval)
+
+    def __refresh_in_background(self):
+        """Starts a refresh on another thread unless one is running."""
+        if not self.__refresh_lock.acquire(blocking=False):
+            return
+
+        def refresh():
+            try:
+                with self.__lock:
+                    self.fetch()
+            except requests.RequestException:
+                logger.exception('Could not refresh Google certificates.')
+            finally:
+                self.__refresh_lock.release()
+
+        threading.Thread(target=refresh, name='google-certs', daemon=True).start()
@@ -0,0 +1,93 @@
+"""
+Key pairs used to sign tokens with an asymmetric algorithm.
+"""
+
+import os
+from pathlib import Path
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm
+
+ASYMMETRIC_ALGORITHMS = {
+    'ES256': ECAlgorithm,
+    'EdDSA': OKPAlgorithm
+}
+
+
+class KeyRing:
+    """
+    A set of private keys identified by key ID. One key signs new tokens,
+    while every key in the ring can still verify tokens, so keys can be
+    rotated without invalidating tokens that were already issued.
+    """
+
+    def __init__(self, algorithm: str, keys: dict, active_kid: str):
+        """
+        Parameters:
+            algorithm: The JWT algorithm, either 'ES256' or 'EdDSA'.
+            keys: The private keys, by key ID.
+            active_kid: The ID of the key that signs new tokens.
+        """
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f'{algorithm} is not a supported signing algorithm.')
+        if active_kid not in keys:
+            raise ValueError(f'The active key {active_kid} is not in the key ring.')
+
+        self.algorithm = algorithm
+        self.keys = keys
+        self.active_kid = active_kid
+        self.public_keys = {kid: key.public_key() for kid, key in keys.items()}
+
+    @classmethod
+    def from_directory(cls, algorithm: str, path: str, active_kid: str = None):
+        """
+        Loads every `<kid>.pem` private key in a directory.
+
+        Parameters:
+            algorithm: The JWT algorithm, either 'ES256' or 'EdDSA'.
+            path: The directory containing the keys.
+            active_kid: The ID of the key that signs new tokens. Defaults to
+                the last key ID in sorted order, so date-prefixed key IDs
+                rotate automatically.
+        """
+        keys = {file.stem: load_pem_private_key(file.read_bytes(), password=None)
+                for file in sorted(Path(path).glob('*.pem'))}
+        if not keys:
+            raise ValueError(f'No signing keys were found in {path}.')
+
+        return cls(algorithm, keys, active_kid or list(keys)[-1])
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Loads the key ring configured by JWT_ALGORITHM, JWT_KEYS_DIR and
+        JWT_ACTIVE_KID.
+
+        Returns:
+            The key ring, or None when tokens are signed with JWT_SECRET.
+        """
+        algorithm = os.getenv('JWT_ALGORITHM', 'HS256')
+        if algorithm == 'HS256':
+            return None
+        return cls.from_directory(algorithm,
+                                  os.getenv('JWT_KEYS_DIR', 'keys'),
+                                  os.getenv('JWT_ACTIVE_KID'))
+
+    @property
+    def signing_key(self):
+        """The private key that signs new tokens."""
+        return self.keys[self.active_kid]
+
+    def jwks(self) -> dict:
+        """
+        Builds the JSON Web Key Set of every public key in the ring.
+
+        Returns:
+            The JWKS document.
+        """
+        jwk_algorithm = ASYMMETRIC_ALGORITHMS[self.algorithm]
+        keys = []
+        for kid, public_key in self.public_keys.items():
+            jwk = jwk_algorithm.to_jwk(public_key, as_dict=True)
+            jwk.update({'kid': kid, 'alg': self.algorithm, 'use': 'sig'})
+            keys.append(jwk)
+        return {'keys': keys}
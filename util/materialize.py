@@ -0,0 +1,264 @@
+"""
+Maintains 'resolved_accounts', a materialized copy of every account with
+its merged authorizations, for services and reports that read MongoDB
+directly instead of calling this service.
+
+When MATERIALIZE_ACCOUNTS is 'true', AsyncAuthDB rewrites an account's
+resolved document whenever it writes the account. Role edits are handled
+by one process, started with `follow`, that follows the role snapshot and
+recomputes only the accounts that have a role that changed, so the
+service's workers do not all repeat the work. A worker whose role snapshot
+lags the edit can still write an account with the old roles, so the same
+accounts are recomputed again once every snapshot has caught up. The command line also
+rebuilds the collection or verifies it:
+
+    python -m util.materialize follow
+    python -m util.materialize verify
+    python -m util.materialize rebuild
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from dotenv import load_dotenv
+from pymongo import DeleteOne, MongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
+from util.db import (RESOLVED_ACCOUNT_INDEXES, RoleCache, materialize_operations,
+                     mongo_client_options, resolved_account, role_fingerprint,
+                     unexpected_write_errors)
+
+logger = logging.getLogger(__name__)
+
+# The number of email addresses listed for each kind of mismatch.
+EXAMPLE_COUNT = 10
+# The number of seconds, beyond the role cache's poll interval, before the
+# accounts with an edited role are recomputed again.
+SETTLE_MARGIN = 5
+
+
+class AccountMaterializer:
+    """Writes resolved account documents in batches, on the synchronous driver."""
+
+    def __init__(self, account_collection, resolved_account_collection,
+                 role_cache: RoleCache, batch_size: int = 1000,
+                 settle_delay: float = 30 + SETTLE_MARGIN):
+        """
+        Parameters:
+            account_collection: The 'accounts' collection.
+            resolved_account_collection: The 'resolved_accounts' collection.
+            role_cache: The role snapshot accounts are resolved against.
+            batch_size: The number of accounts written per bulk write.
+            settle_delay: The number of seconds after a role edit before its
+                accounts are recomputed again, by which time every worker's
+                role snapshot has the edit.
+        """
+        self.account_collection = account_collection
+        self.resolved_account_collection = resolved_account_collection
+        self.role_cache = role_cache
+        self.batch_size = batch_size
+        self.settle_delay = settle_delay
+        self.role_versions = self.__role_versions()
+        self.__rechecks = []
+
+    @classmethod
+    def from_environment(cls, role_cache: RoleCache = None):
+        """
+        Connects to MONGODB_URL.
+
+        Parameters:
+            role_cache: The role snapshot. One is loaded if it is not given.
+        """
+        database = MongoClient(os.getenv('MONGODB_URL'),
+                               **mongo_client_options())['Accounts']
+        if role_cache is None:
+            role_cache = RoleCache(database.get_collection('roles'))
+            role_cache.load()
+        poll_interval = float(os.getenv('ROLE_CACHE_POLL_INTERVAL', '30'))
+        return cls(database.get_collection('accounts'),
+                   database.get_collection('resolved_accounts'),
+                   role_cache,
+                   settle_delay=poll_interval + SETTLE_MARGIN)
+
+    @classmethod
+    def follow(cls):
+        """
+        Rebuilds the collection, which catches up on role edits made while
+        no materializer was running, then recomputes the accounts affected
+        by each change to the role snapshot from a background thread.
+
+        Returns:
+            The materializer.
+        """
+        materializer = cls.from_environment()
+        materializer.rebuild()
+        materializer.role_cache.listeners.append(materializer.roles_changed)
+        materializer.role_cache.start()
+        return materializer
+
+    def __role_versions(self) -> dict[str, str]:
+        """Fingerprints each role in the snapshot."""
+        return {name: role_fingerprint([role_data])
+                for name, role_data in self.role_cache.roles.items()}
+
+    def __write(self, account_documents) -> int:
+        """Writes the resolved documents of accounts in batches."""
+        count = 0
+        batch = []
+        for account_data in account_documents:
+            batch.append(account_data)
+            if len(batch) == self.batch_size:
+                count += self.__write_batch(batch)
+                batch = []
+        if batch:
+            count += self.__write_batch(batch)
+        return count
+
+    def __write_batch(self, account_documents: list[dict]) -> int:
+        emails = [account_data['email'] for account_data in account_documents]
+        try:
+            self.resolved_account_collection.bulk_write(
+                materialize_operations(emails, account_documents, self.role_cache),
+                ordered=False)
+        except BulkWriteError as e:
+            if unexpected_write_errors(e.details):
+                raise
+        return len(account_documents)
+
+    def roles_changed(self):
+        """Recomputes the accounts with a role that was added, edited or removed."""
+        role_versions = self.__role_versions()
+        changed = [name for name in role_versions.keys() | self.role_versions.keys()
+                   if role_versions.get(name) != self.role_versions.get(name)]
+        try:
+            self.refresh_roles(changed)
+        except PyMongoError:
+            # The roles stay marked as changed, so the next change retries them.
+            logger.exception('Could not recompute the accounts with roles %s.', changed)
+            return
+        self.role_versions = role_versions
+        if changed:
+            self.__schedule_recheck(changed)
+
+    def __schedule_recheck(self, role_names: list[str]):
+        """Recomputes the accounts with some roles again after the settle delay."""
+        self.__rechecks = [timer for timer in self.__rechecks if timer.is_alive()]
+        timer = threading.Timer(self.settle_delay, self.__recheck, [role_names])
+        timer.daemon = True
+        self.__rechecks.append(timer)
+        timer.start()
+
+    def __recheck(self, role_names: list[str]):
+        try:
+            self.refresh_roles(role_names)
+        except PyMongoError:
+            logger.exception('Could not recompute the accounts with roles %s again. '
+                             'Run `python -m util.materialize verify` to find them.',
+                             role_names)
+
+    def stop(self):
+        """Stops following the role snapshot and cancels scheduled recomputations."""
+        self.role_cache.stop()
+        for timer in self.__rechecks:
+            timer.cancel()
+
+    def refresh_roles(self, role_names: list[str]) -> int:
+        """
+        Recomputes the accounts with any of the given roles. The multikey
+        index on roles finds them without a collection scan.
+
+        Parameters:
+            role_names: The names of the roles.
+
+        Returns:
+            The number of accounts written.
+        """
+        if not role_names:
+            return 0
+        return self.__write(self.account_collection.find(
+            {'roles': {'$in': list(role_names)}}, {'_id': 0}))
+
+    def rebuild(self) -> dict:
+        """
+        Rewrites every resolved document, and removes the documents of
+        accounts that no longer exist.
+
+        Returns:
+            The number of accounts written and of documents removed.
+        """
+        self.resolved_account_collection.create_indexes(RESOLVED_ACCOUNT_INDEXES)
+        emails = set()
+
+        def accounts():
+            for account_data in self.account_collection.find({}, {'_id': 0}):
+                emails.add(account_data['email'])
+                yield account_data
+
+        written = self.__write(accounts())
+        orphaned = [resolved['email'] for resolved
+                    in self.resolved_account_collection.find({}, {'_id': 0, 'email': 1})
+                    if resolved['email'] not in emails]
+        if orphaned:
+            self.resolved_account_collection.bulk_write(
+                [DeleteOne({'email': email}) for email in orphaned], ordered=False)
+
+        return {'written': written, 'removed': len(orphaned)}
+
+    def verify(self) -> dict:
+        """
+        Compares every resolved document with the account it was built from.
+
+        Returns:
+            The number of accounts checked, and the number and some of the
+            email addresses of accounts whose resolved document is missing
+            or stale, and of resolved documents without an account.
+        """
+        resolved = {document['email']: document for document
+                    in self.resolved_account_collection.find({}, {'_id': 0})}
+        mismatches = {'missing': [], 'stale': []}
+        checked = 0
+        for account_data in self.account_collection.find({}, {'_id': 0}):
+            checked += 1
+            stored = resolved.pop(account_data['email'], None)
+            if stored is None:
+                mismatches['missing'].append(account_data['email'])
+            elif stored != resolved_account(account_data, self.role_cache):
+                mismatches['stale'].append(account_data['email'])
+        mismatches['orphaned'] = list(resolved)
+
+        report = {'checked': checked, 'consistent': not any(mismatches.values())}
+        for kind, emails in mismatches.items():
+            report[kind] = {'count': len(emails), 'examples': emails[:EXAMPLE_COUNT]}
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Follows, rebuilds or verifies the resolved_accounts collection.')
+    parser.add_argument('command', choices=('follow', 'rebuild', 'verify'))
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.command == 'follow':
+        materializer = AccountMaterializer.follow()
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            materializer.stop()
+        return
+
+    materializer = AccountMaterializer.from_environment()
+    if args.command == 'rebuild':
+        print(json.dumps(materializer.rebuild(), indent=2))
+        return
+
+    report = materializer.verify()
+    print(json.dumps(report, indent=2))
+    if not report['consistent']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
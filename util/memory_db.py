@@ -0,0 +1,181 @@
+"""
+A storage backend that keeps accounts and roles in memory, for tests,
+benchmarks and profiling without MongoDB. Nothing is persisted.
+"""
+
+import time
+from bisect import bisect_right, insort
+from copy import deepcopy
+from util.cache import LRUCache
+from util.db import RoleCache
+from util.storage import AuthStorage, apply_role_update
+
+
+class MemoryRoles:
+    """Role documents by name, readable by RoleCache like a collection."""
+
+    def __init__(self):
+        self.documents = {}
+
+    def find(self, query=None, projection=None):
+        return [deepcopy(document) for document in self.documents.values()]
+
+
+class MemoryAuthDB(AuthStorage):
+    """
+    Keeps account documents by email address, plus a sorted list of email
+    addresses for each role, so accounts are found by role in email order
+    without a scan, like the (roles, email) index in MongoDB.
+    """
+    accounts = None
+    role_index = None
+    roles = None
+    revoked_tokens = None
+
+    @classmethod
+    async def setup(cls):
+        """Creates the empty collections on first use."""
+        if cls.accounts is None:
+            cls.reset()
+
+    @classmethod
+    def reset(cls, accounts: list[dict] = (), roles: list[dict] = ()):
+        """
+        Replaces every account and role.
+
+        Parameters:
+            accounts: The account documents.
+            roles: The role documents.
+        """
+        cls.accounts = {}
+        cls.role_index = {}
+        cls.revoked_tokens = {}
+        cls.roles = MemoryRoles()
+        # Reads are already served from memory, so a cache would only add
+        # copies.
+        cls.account_cache = LRUCache(maxsize=0)
+        cls.role_cache = RoleCache(cls.roles)
+        for account_data in accounts:
+            account_data = deepcopy(account_data)
+            cls.accounts[account_data['email']] = account_data
+            for role in set(account_data.get('roles', [])):
+                cls.role_index.setdefault(role, []).append(account_data['email'])
+        # Sorting once is much faster than inserting every email in order.
+        for emails in cls.role_index.values():
+            emails.sort()
+        for role_data in roles:
+            cls.roles.documents[role_data['name']] = deepcopy(role_data)
+        cls.role_cache.load()
+
+    @classmethod
+    async def put_role(cls, role_data: dict):
+        """
+        Creates or replaces a role and reloads the role snapshot.
+
+        Parameters:
+            role_data: The role document, with 'name' and 'authorizations'.
+        """
+        await cls.setup()
+        cls.roles.documents[role_data['name']] = deepcopy(role_data)
+        cls.role_cache.load()
+
+    @classmethod
+    def __store(cls, account_data: dict):
+        """Stores an account document and indexes its roles."""
+        email = account_data['email']
+        previous_data = cls.accounts.get(email)
+        previous_roles = set(previous_data.get('roles', [])) if previous_data else set()
+        roles = set(account_data.get('roles', []))
+
+        for role in previous_roles - roles:
+            emails = cls.role_index[role]
+            del emails[bisect_right(emails, email) - 1]
+        for role in roles - previous_roles:
+            insort(cls.role_index.setdefault(role, []), email)
+
+        cls.accounts[email] = account_data
+
+    @classmethod
+    async def _find_account(cls, email: str) -> dict:
+        account_data = cls.accounts.get(email)
+        return deepcopy(account_data) if account_data is not None else None
+
+    @classmethod
+    async def _find_or_insert_account(cls, account_data: dict) -> dict:
+        # Nothing is awaited between the check and the insert, so this is
+        # atomic on the event loop.
+        if account_data['email'] not in cls.accounts:
+            cls.__store(deepcopy(account_data))
+        return deepcopy(cls.accounts[account_data['email']])
+
+    @classmethod
+    async def _find_accounts_by_role(cls, role: str, after: str, limit: int):
+        emails = cls.role_index.get(role, [])
+        start = bisect_right(emails, after) if after is not None else 0
+        end = start + limit if limit else len(emails)
+        for email in emails[start:end]:
+            yield deepcopy(cls.accounts[email])
+
+    @classmethod
+    async def _update_account(cls, account_data: dict):
+        account = cls.accounts.get(account_data['email'])
+        if account is not None:
+            cls.__store({**account, **deepcopy(account_data),
+                         'authz_version': account.get('authz_version', 0) + 1})
+
+    @classmethod
+    async def _update_account_roles(cls, email: str, add_roles: list[str],
+                                    remove_roles: list[str]) -> dict:
+        account_data = deepcopy(cls.accounts.get(email)) or {'email': email, 'roles': []}
+        account_data['roles'] = apply_role_update(account_data.get('roles', []),
+                                                  add_roles, remove_roles)
+        account_data['authz_version'] = account_data.get('authz_version', 0) + 1
+        cls.__store(account_data)
+        return deepcopy(account_data)
+
+    @classmethod
+    async def _update_roles(cls, updates: list[dict]) -> list[dict]:
+        results = []
+        for update in updates:
+            email = update['email']
+            account_data = cls.accounts.get(email)
+            status = 'updated' if account_data is not None else 'created'
+            account_data = deepcopy(account_data) or {'email': email, 'roles': []}
+            account_data['roles'] = apply_role_update(
+                account_data.get('roles', []),
+                update.get('add_roles', []),
+                update.get('remove_roles', []))
+            account_data['authz_version'] = account_data.get('authz_version', 0) + 1
+            cls.__store(account_data)
+            results.append({'email': email, 'status': status})
+        return results
+
+    @classmethod
+    async def _delete_account(cls, email: str):
+        account_data = cls.accounts.get(email)
+        if account_data is not None:
+            cls.__store({'email': email, 'roles': []})
+            del cls.accounts[email]
+
+    @classmethod
+    async def _insert_account(cls, account_data: dict):
+        if account_data['email'] in cls.accounts:
+            raise ValueError(f'An account for {account_data["email"]} already exists.')
+        cls.__store(deepcopy(account_data))
+
+    @classmethod
+    async def _insert_revoked_token(cls, jti: str, expires_at: float,
+                                    revoked_at: float) -> bool:
+        if jti in cls.revoked_tokens:
+            return False
+        cls.revoked_tokens[jti] = {'jti': jti, 'expires_at': expires_at,
+                                   'revoked_at': revoked_at}
+        return True
+
+    @classmethod
+    async def _find_revoked_tokens(cls, since: float, prefix: str) -> list[dict]:
+        now = time.time()
+        cls.revoked_tokens = {jti: record for jti, record in cls.revoked_tokens.items()
+                              if record['expires_at'] > now}
+        return [dict(record) for record in cls.revoked_tokens.values()
+                if record['revoked_at'] >= since and record['jti'].startswith(prefix)]
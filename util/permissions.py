@@ -0,0 +1,114 @@
+"""
+Compiles authorizations into integer bitsets, so checking a permission is a
+single AND.
+"""
+
+import threading
+
+READ = '_read:'
+WRITE = '_write:'
+
+
+class Authorizations(dict):
+    """
+    Merged authorizations that carry their compiled permission bitset, and
+    a fingerprint of the role documents they were merged from.
+    """
+    __slots__ = ('bits', 'version')
+
+
+class PermissionBits:
+    """
+    Assigns every permission a bit index. Permissions are the keys of an
+    authorizations dictionary, plus `_read:<role>` and `_write:<role>` for
+    each role in the `_read` and `_write` lists.
+
+    Indexes are only ever added, so a bitset compiled earlier in the
+    process stays valid as new permissions appear. Indexes follow the order
+    permissions are first seen in, so bitsets are only meaningful within
+    the process that compiled them and are never sent to clients.
+    """
+
+    def __init__(self):
+        self.indexes: dict[str, int] = {}
+        self.__lock = threading.Lock()
+
+    def index(self, permission: str) -> int:
+        """
+        Gets the bit index of a permission, assigning the next free index if
+        the permission is new.
+
+        Parameters:
+            permission: The permission.
+
+        Returns:
+            The bit index.
+        """
+        index = self.indexes.get(permission)
+        if index is None:
+            with self.__lock:
+                index = self.indexes.setdefault(permission, len(self.indexes))
+        return index
+
+    def mask(self, permissions: list[str]) -> int:
+        """
+        Builds the bitset with every given permission.
+
+        Parameters:
+            permissions: The permissions.
+
+        Returns:
+            The bitset.
+        """
+        bits = 0
+        for permission in permissions:
+            bits |= 1 << self.index(permission)
+        return bits
+
+    def compile(self, authorizations: dict) -> int:
+        """
+        Compiles authorizations into a bitset. Keys with truthy values are
+        granted, as are the roles in the `_read` and `_write` lists.
+
+        Parameters:
+            authorizations: The authorizations of a role or account.
+
+        Returns:
+            The bitset.
+        """
+        bits = getattr(authorizations, 'bits', None)
+        if bits is not None:
+            return bits
+
+        permissions = []
+        for key, value in authorizations.items():
+            if key == '_read':
+                permissions.extend(READ + role for role in value)
+            elif key == '_write':
+                permissions.extend(WRITE + role for role in value)
+            elif value:
+                permissions.append(key)
+        return self.mask(permissions)
+
+    def allows(self, bits: int, permissions: list[str]) -> bool:
+        """
+        Checks that a bitset grants every given permission. Permissions that
+        were never granted to anyone have no index and are denied.
+
+        Parameters:
+            bits: The bitset of a role or account.
+            permissions: The permissions to check.
+
+        Returns:
+            Whether every permission is granted.
+        """
+        mask = 0
+        for permission in permissions:
+            index = self.indexes.get(permission)
+            if index is None:
+                return False
+            mask |= 1 << index
+        return bits & mask == mask
+
+
+permission_bits = PermissionBits()
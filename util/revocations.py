@@ -0,0 +1,77 @@
+"""
+An in-memory copy of revoked token IDs, so checking a token for
+revocation does not query the database.
+"""
+
+import os
+import time
+
+# Records are read from slightly before the last sync, so a revocation
+# written by another worker with a lagging clock is not missed.
+SYNC_OVERLAP = 5
+
+
+class RevocationList:
+    """
+    The revoked token IDs and when they expire. The list is synced
+    incrementally from storage: every sync reads only the IDs revoked since
+    the previous one, and drops IDs whose tokens have all expired.
+    """
+
+    def __init__(self, sync_interval: float = 5, prefix: str = ''):
+        """
+        Parameters:
+            sync_interval: The minimum number of seconds between syncs.
+            prefix: Only revoked IDs that start with this prefix are kept.
+        """
+        self.sync_interval = sync_interval
+        self.prefix = prefix
+        self.revoked: dict[str, float] = {}
+        self.synced_at = None
+        self.__next_sync = 0
+
+    @classmethod
+    def from_environment(cls, prefix: str = ''):
+        """
+        Creates a revocation list synced every REVOCATION_SYNC_INTERVAL seconds.
+
+        Parameters:
+            prefix: Only revoked IDs that start with this prefix are kept.
+        """
+        return cls(float(os.getenv('REVOCATION_SYNC_INTERVAL', '5')), prefix)
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self.revoked
+
+    def add(self, jti: str, expires_at: float):
+        """
+        Adds a revoked token ID.
+
+        Parameters:
+            jti: The token ID.
+            expires_at: When every token with the ID has expired.
+        """
+        self.revoked[jti] = expires_at
+
+    async def sync(self, storage, force: bool = False):
+        """
+        Reads the IDs revoked since the last sync, unless the last sync was
+        less than `sync_interval` seconds ago.
+
+        Parameters:
+            storage: The storage backend.
+            force: Whether to sync regardless of the interval.
+        """
+        now = time.time()
+        if not force and now < self.__next_sync:
+            return
+        # Claimed before awaiting, so concurrent requests do not sync too.
+        self.__next_sync = now + self.sync_interval
+
+        since = self.synced_at - SYNC_OVERLAP if self.synced_at is not None else 0
+        records = await storage.get_revoked_tokens(since, self.prefix)
+        for record in records:
+            self.add(record['jti'], record['expires_at'])
+        self.revoked = {jti: expires_at for jti, expires_at in self.revoked.items()
+                        if expires_at > now}
+        self.synced_at = now
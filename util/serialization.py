@@ -0,0 +1,68 @@
+"""
+JSON encoding on orjson, shared by tokens and responses, so a payload that
+goes into both a token and a response is encoded once.
+"""
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def dumps(value) -> bytes:
+    """
+    Encodes a value as compact JSON.
+
+    Parameters:
+        value: The value. Dictionaries, including subclasses such as
+            Authorizations, lists, strings, numbers and None are supported.
+
+    Returns:
+        The JSON bytes.
+    """
+    return orjson.dumps(value)
+
+
+def encode_object(fields: dict) -> bytes:
+    """
+    Encodes a JSON object whose values may already be encoded. Bytes are
+    taken as encoded JSON and copied as they are, since bytes are not JSON
+    values themselves.
+
+    Parameters:
+        fields: The keys and values of the object.
+
+    Returns:
+        The JSON bytes.
+    """
+    return b'{' + b','.join(
+        dumps(key) + b':' + (value if isinstance(value, bytes) else dumps(value))
+        for key, value in fields.items()) + b'}'
+
+
+def prepend_field(encoded_object: bytes, key: str, value) -> bytes:
+    """
+    Adds a field to the front of an encoded JSON object without decoding it.
+
+    Parameters:
+        encoded_object: The encoded object, which must not have the key.
+        key: The key of the field.
+        value: The value of the field.
+
+    Returns:
+        The JSON bytes.
+    """
+    field = dumps(key) + b':' + dumps(value)
+    if encoded_object == b'{}':
+        return b'{' + field + b'}'
+    return b'{' + field + b',' + encoded_object[1:]
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSON response encoded with orjson. Content that is already encoded,
+    as bytes, is sent as it is.
+    """
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,39 @@
+"""
+Coalesces concurrent identical lookups, so a burst of requests for the same
+account or role shares one database query and its result.
+"""
+
+import asyncio
+
+
+class AsyncSingleFlight:
+    """
+    Runs at most one call per key at a time on the event loop. The call
+    runs as its own task, so a caller that is cancelled does not cancel it
+    for the other callers.
+    """
+
+    def __init__(self):
+        self.__tasks = {}
+
+    def __len__(self):
+        return len(self.__tasks)
+
+    async def do(self, key, function, *args):
+        """
+        Awaits a coroutine function, or the call already in flight for the key.
+
+        Parameters:
+            key: Identifies calls that are interchangeable.
+            function: The coroutine function to call.
+            args: The arguments of the function.
+
+        Returns:
+            The result of the call, shared by every caller of the key.
+        """
+        task = self.__tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function(*args))
+            self.__tasks[key] = task
+            task.add_done_callback(lambda _: self.__tasks.pop(key, None))
+        return await asyncio.shield(task)
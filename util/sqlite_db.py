@@ -0,0 +1,234 @@
+"""
+A storage backend on a SQLite file, for running the service on a laptop or
+in CI without MongoDB.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from util.db import RoleCache, get_account_cache
+from util.storage import AuthStorage, apply_role_update
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accounts (
+    email TEXT PRIMARY KEY,
+    document TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS account_roles (
+    role TEXT NOT NULL,
+    email TEXT NOT NULL,
+    PRIMARY KEY (role, email)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS roles (
+    name TEXT PRIMARY KEY,
+    document TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    revoked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revoked_tokens_revoked_at ON revoked_tokens (revoked_at);
+CREATE INDEX IF NOT EXISTS revoked_tokens_expires_at ON revoked_tokens (expires_at);
+'''
+
+
+class SqliteRoles:
+    """The roles table, readable by RoleCache like a collection."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def find(self, query=None, projection=None):
+        # The role cache polls from its own thread, so it opens its own
+        # connection.
+        with closing(sqlite3.connect(self.path)) as connection:
+            return [json.loads(document) for (document,)
+                    in connection.execute('SELECT document FROM roles')]
+
+
+class SqliteAuthDB(AuthStorage):
+    """
+    Stores each account as a JSON document, with an (role, email) table
+    that finds accounts by role in email order, like the (roles, email)
+    index in MongoDB. The file is set by SQLITE_PATH.
+    """
+    connection = None
+
+    @classmethod
+    async def setup(cls):
+        """Opens the database file and creates the tables on first use."""
+        if cls.connection is not None:
+            return
+
+        path = os.getenv('SQLITE_PATH', 'auth.sqlite3')
+        connection = sqlite3.connect(path)
+        connection.executescript(SCHEMA)
+        cls.connection = connection
+
+        cls.account_cache = get_account_cache()
+        cls.role_cache = RoleCache(
+            SqliteRoles(path),
+            poll_interval=float(os.getenv('ROLE_CACHE_POLL_INTERVAL', '30')))
+        cls.role_cache.listeners.append(cls.account_cache.clear)
+        cls.role_cache.start()
+
+    @classmethod
+    def close(cls):
+        """Closes the database file and stops following the roles table."""
+        if cls.connection is None:
+            return
+        cls.role_cache.stop()
+        cls.account_cache.clear()
+        cls.connection.close()
+        cls.connection = None
+        cls.role_cache = None
+
+    @classmethod
+    async def ping(cls) -> float:
+        """
+        Runs a trivial query.
+
+        Returns:
+            The round trip time in seconds.
+        """
+        await cls.setup()
+        start = time.perf_counter()
+        cls.connection.execute('SELECT 1').fetchone()
+        return time.perf_counter() - start
+
+    @classmethod
+    async def put_role(cls, role_data: dict):
+        """
+        Creates or replaces a role and reloads the role snapshot.
+
+        Parameters:
+            role_data: The role document, with 'name' and 'authorizations'.
+        """
+        await cls.setup()
+        with cls.connection:
+            cls.connection.execute(
+                'INSERT INTO roles (name, document) VALUES (?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET document = excluded.document',
+                (role_data['name'], json.dumps(role_data)))
+        cls.role_cache.load()
+
+    @classmethod
+    def __store(cls, account_data: dict):
+        """Writes an account document and its roles. Call within a transaction."""
+        email = account_data['email']
+        cls.connection.execute(
+            'INSERT INTO accounts (email, document) VALUES (?, ?) '
+            'ON CONFLICT (email) DO UPDATE SET document = excluded.document',
+            (email, json.dumps(account_data)))
+        cls.connection.execute('DELETE FROM account_roles WHERE email = ?', (email,))
+        cls.connection.executemany(
+            'INSERT OR IGNORE INTO account_roles (role, email) VALUES (?, ?)',
+            [(role, email) for role in account_data.get('roles', [])])
+
+    @classmethod
+    def __read(cls, email: str) -> dict:
+        """Reads an account document, or returns None."""
+        row = cls.connection.execute(
+            'SELECT document FROM accounts WHERE email = ?', (email,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    @classmethod
+    async def _find_account(cls, email: str) -> dict:
+        return cls.__read(email)
+
+    @classmethod
+    async def _find_or_insert_account(cls, account_data: dict) -> dict:
+        with cls.connection:
+            if cls.__read(account_data['email']) is None:
+                cls.__store(account_data)
+            return cls.__read(account_data['email'])
+
+    @classmethod
+    async def _find_accounts_by_role(cls, role: str, after: str, limit: int):
+        query = ('SELECT accounts.document FROM account_roles '
+                 'JOIN accounts USING (email) WHERE account_roles.role = ?')
+        parameters = [role]
+        if after is not None:
+            query += ' AND account_roles.email > ?'
+            parameters.append(after)
+        query += ' ORDER BY account_roles.email'
+        if limit:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+
+        for (document,) in cls.connection.execute(query, parameters):
+            yield json.loads(document)
+
+    @classmethod
+    async def _update_account(cls, account_data: dict):
+        with cls.connection:
+            existing_data = cls.__read(account_data['email'])
+            if existing_data is not None:
+                cls.__store({**existing_data, **account_data,
+                             'authz_version': existing_data.get('authz_version', 0) + 1})
+
+    @classmethod
+    async def _update_account_roles(cls, email: str, add_roles: list[str],
+                                    remove_roles: list[str]) -> dict:
+        with cls.connection:
+            account_data = cls.__read(email) or {'email': email, 'roles': []}
+            account_data['roles'] = apply_role_update(account_data.get('roles', []),
+                                                      add_roles, remove_roles)
+            account_data['authz_version'] = account_data.get('authz_version', 0) + 1
+            cls.__store(account_data)
+        return account_data
+
+    @classmethod
+    async def _update_roles(cls, updates: list[dict]) -> list[dict]:
+        results = []
+        with cls.connection:
+            for update in updates:
+                email = update['email']
+                account_data = cls.__read(email)
+                status = 'updated' if account_data is not None else 'created'
+                account_data = account_data or {'email': email, 'roles': []}
+                account_data['roles'] = apply_role_update(
+                    account_data.get('roles', []),
+                    update.get('add_roles', []),
+                    update.get('remove_roles', []))
+                account_data['authz_version'] = account_data.get('authz_version', 0) + 1
+                cls.__store(account_data)
+                results.append({'email': email, 'status': status})
+        return results
+
+    @classmethod
+    async def _delete_account(cls, email: str):
+        with cls.connection:
+            cls.connection.execute('DELETE FROM account_roles WHERE email = ?', (email,))
+            cls.connection.execute('DELETE FROM accounts WHERE email = ?', (email,))
+
+    @classmethod
+    async def _insert_account(cls, account_data: dict):
+        with cls.connection:
+            cls.connection.execute(
+                'INSERT INTO accounts (email, document) VALUES (?, ?)',
+                (account_data['email'], json.dumps(account_data)))
+            cls.__store(account_data)
+
+    @classmethod
+    async def _insert_revoked_token(cls, jti: str, expires_at: float,
+                                    revoked_at: float) -> bool:
+        with cls.connection:
+            cls.connection.execute('DELETE FROM revoked_tokens WHERE expires_at <= ?',
+                                   (revoked_at,))
+            cursor = cls.connection.execute(
+                'INSERT OR IGNORE INTO revoked_tokens (jti, expires_at, revoked_at) '
+                'VALUES (?, ?, ?)', (jti, expires_at, revoked_at))
+        return cursor.rowcount == 1
+
+    @classmethod
+    async def _find_revoked_tokens(cls, since: float, prefix: str) -> list[dict]:
+        rows = cls.connection.execute(
+            'SELECT jti, expires_at, revoked_at FROM revoked_tokens '
+            'WHERE revoked_at >= ? AND expires_at > ? AND substr(jti, 1, ?) = ?',
+            (since, time.time(), len(prefix), prefix))
+        return [{'jti': jti, 'expires_at': expires_at, 'revoked_at': revoked_at}
+                for jti, expires_at, revoked_at in rows]
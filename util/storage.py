@@ -0,0 +1,458 @@
+"""
+The storage interface for accounts, and the setting that selects its backend.
+
+Every backend shares the account cache and role resolution implemented by
+`AuthStorage`, and only implements the underscored methods that read and
+write stored account documents. AUTH_STORAGE selects the backend: `mongo`
+(the default), `memory` or `sqlite`.
+"""
+
+import importlib
+import os
+import time
+from copy import deepcopy
+from util.metrics import DB_LATENCY, timed
+from util.singleflight import AsyncSingleFlight
+
+STORAGE_BACKENDS = {
+    'mongo': ('util.db', 'AsyncAuthDB'),
+    'memory': ('util.memory_db', 'MemoryAuthDB'),
+    'sqlite': ('util.sqlite_db', 'SqliteAuthDB')
+}
+
+_storages = {}
+
+
+def get_storage():
+    """
+    Gets the storage backend selected by AUTH_STORAGE.
+
+    Returns:
+        The storage class.
+    """
+    name = os.getenv('AUTH_STORAGE', 'mongo')
+    storage = _storages.get(name)
+    if storage is None:
+        if name not in STORAGE_BACKENDS:
+            raise ValueError(f'{name} is not a supported storage backend. '
+                             f'Use one of {", ".join(STORAGE_BACKENDS)}.')
+        module, attribute = STORAGE_BACKENDS[name]
+        storage = getattr(importlib.import_module(module), attribute)
+        _storages[name] = storage
+    return storage
+
+
+def apply_role_update(roles: list[str], add_roles: list[str],
+                      remove_roles: list[str]) -> list[str]:
+    """
+    Adds and removes roles the way the Mongo bulk update does: removed roles
+    are pulled unless they are also added, then added roles are appended if
+    they are missing.
+
+    Parameters:
+        roles: The account's roles.
+        add_roles: The roles to add.
+        remove_roles: The roles to remove.
+
+    Returns:
+        The updated roles.
+    """
+    roles = [role for role in roles
+             if role not in remove_roles or role in add_roles]
+    for role in add_roles:
+        if role not in roles:
+            roles.append(role)
+    return roles
+
+
+def authz_version(account_data: dict, authorizations) -> str:
+    """
+    Builds the authorization version of a resolved account. It changes
+    whenever the account's roles are written, which increments the stored
+    `authz_version`, or when any of its roles is edited.
+
+    Parameters:
+        account_data: The account document.
+        authorizations: The authorizations resolved from its roles.
+
+    Returns:
+        The version, such as '3-9f2c1a7b'.
+    """
+    return f"{account_data.get('authz_version', 0)}-{authorizations.version}"
+
+
+class AuthStorage:
+    """
+    The storage interface used by the Account model. Backends subclass it
+    and implement `setup` and the underscored methods; accounts they return
+    are resolved against the role snapshot and cached here.
+    """
+    account_cache = None
+    role_cache = None
+    # Connection pool stats, for backends that have a pool.
+    pool_stats = None
+    # Concurrent misses for the same lookup share one query.
+    lookups = AsyncSingleFlight()
+
+    @classmethod
+    async def setup(cls):
+        """Connects to the backend and sets `account_cache` and `role_cache`."""
+        raise NotImplementedError
+
+    @classmethod
+    async def connect(cls):
+        """Connects before the first request and loads the role snapshot."""
+        await cls.setup()
+
+    @classmethod
+    async def ping(cls) -> float:
+        """
+        Checks that the backend is reachable.
+
+        Returns:
+            The round trip time in seconds.
+        """
+        start = time.perf_counter()
+        await cls.setup()
+        return time.perf_counter() - start
+
+    @classmethod
+    async def _find_account(cls, email: str) -> dict:
+        """Reads an account document, or returns None."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _find_or_insert_account(cls, account_data: dict) -> dict:
+        """Reads an account document, atomically inserting it if it is missing."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _find_accounts_by_role(cls, role: str, after: str, limit: int):
+        """Yields the account documents with a role in email order."""
+        raise NotImplementedError
+        yield  # Makes this an async generator, like the implementations.
+
+    @classmethod
+    async def _update_account(cls, account_data: dict):
+        """Sets the fields of an existing account document and increments its
+        'authz_version'."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _update_account_roles(cls, email: str, add_roles: list[str],
+                                    remove_roles: list[str]) -> dict:
+        """Atomically adds and removes roles on an account document, creating
+        it if it is missing and incrementing its 'authz_version', and
+        returns the updated document."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _update_roles(cls, updates: list[dict]) -> list[dict]:
+        """Adds and removes roles on many accounts, creating missing ones and
+        incrementing their 'authz_version'."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _delete_account(cls, email: str):
+        """Deletes an account document."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _insert_account(cls, account_data: dict):
+        """Inserts a new account document."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _insert_revoked_token(cls, jti: str, expires_at: float,
+                                    revoked_at: float) -> bool:
+        """Records a revoked token ID, returning False if it already was."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _find_revoked_tokens(cls, since: float, prefix: str) -> list[dict]:
+        """Reads the unexpired token IDs with a prefix revoked at or after a time."""
+        raise NotImplementedError
+
+    @classmethod
+    async def _find_account_version(cls, email: str) -> dict:
+        """Reads at least the 'roles' and 'authz_version' of an account document."""
+        return await cls._find_account(email)
+
+    @classmethod
+    def __resolve(cls, account_data: dict) -> dict:
+        """Adds the authorizations of the account's roles and its version."""
+        authorizations = cls.role_cache.resolve(account_data.get('roles', []))
+        account_data['authz_version'] = authz_version(account_data, authorizations)
+        account_data['authorizations'] = authorizations
+        return account_data
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def get_account_by_email(cls, email: str) -> dict:
+        """
+        Finds an account given an email address. Resolved accounts are
+        cached until they expire or are written to, and concurrent misses
+        for the same account share one query.
+
+        Parameters:
+            email: The email address of the account.
+
+        Returns:
+            The account data.
+        """
+        await cls.setup()
+
+        cached_account = cls.account_cache.get(email)
+        if cached_account is not None:
+            return deepcopy(cached_account)
+
+        account_data = await cls.lookups.do((cls, 'email', email),
+                                            cls.__load_account, email)
+        return deepcopy(account_data)
+
+    @classmethod
+    async def __load_account(cls, email: str) -> dict:
+        """
+        Reads and resolves an account, and caches it unless the account was
+        written or invalidated while it was read.
+        """
+        token = cls.account_cache.start_fill(email)
+        account_data = None
+        try:
+            account_data = await cls._find_account(email)
+            if account_data is not None:
+                cls.__resolve(account_data)
+        finally:
+            cls.account_cache.fill(email, token, deepcopy(account_data))
+        return account_data
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def get_or_create_account(cls, account_data: dict) -> dict:
+        """
+        Finds an account, creating it first if it does not exist. Concurrent
+        first logins cannot create duplicate accounts.
+
+        Parameters:
+            account_data: The account data to insert if the account is new.
+
+        Returns:
+            The account data.
+        """
+        await cls.setup()
+
+        account_data = cls.__resolve(await cls._find_or_insert_account(account_data))
+        # Invalidated rather than set, since a concurrent write that finished
+        # first may have a newer document than this one.
+        cls.account_cache.invalidate(account_data['email'])
+
+        return account_data
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def get_authz_version(cls, email: str) -> str:
+        """
+        Finds the authorization version of an account, without resolving
+        its authorizations when it is not cached.
+
+        Parameters:
+            email: The email address of the account.
+
+        Returns:
+            The version, or None if the account does not exist.
+        """
+        await cls.setup()
+
+        cached_account = cls.account_cache.get(email)
+        if cached_account is not None:
+            return cached_account['authz_version']
+
+        account_data = await cls._find_account_version(email)
+        if account_data is None:
+            return None
+        return authz_version(account_data,
+                             cls.role_cache.resolve(account_data.get('roles', [])))
+
+    @classmethod
+    async def iter_accounts_by_role(cls, value: str,
+                                    after: str = None,
+                                    limit: int = None):
+        """
+        Yields accounts with a given role in email order, as the backend
+        produces them.
+
+        Parameters:
+            value: The role which all returned accounts will have.
+            after: Only accounts with an email address after this one are
+                returned.
+            limit: The maximum number of accounts to return.
+
+        Returns:
+            An async generator of accounts.
+        """
+        await cls.setup()
+
+        async for account_data in cls._find_accounts_by_role(value, after, limit):
+            yield cls.__resolve(account_data)
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def get_accounts_by_role(cls, value: str,
+                                   after: str = None,
+                                   limit: int = None) -> list[dict]:
+        """
+        Finds all accounts that have a given role.
+
+        Parameters:
+            value: The role which all returned accounts will have.
+            after: Only accounts with an email address after this one are
+                returned.
+            limit: The maximum number of accounts to return.
+
+        Returns:
+            All accounts with the given role, in email order.
+        """
+        # Concurrent identical pages share one query. Each caller gets its
+        # own account dictionaries.
+        accounts = await cls.lookups.do((cls, 'role', value, after, limit),
+                                        cls.__load_accounts_by_role, value, after, limit)
+        return [dict(account_data) for account_data in accounts]
+
+    @classmethod
+    async def __load_accounts_by_role(cls, value: str, after: str,
+                                      limit: int) -> list[dict]:
+        """Reads and resolves a page of accounts with a role."""
+        return [data async for data in cls.iter_accounts_by_role(value, after, limit)]
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def update_account(cls, account: dict):
+        """
+        Updates an account.
+
+        Parameters:
+            account: The account data.
+        """
+        await cls.setup()
+
+        account_copy = account.copy()
+        account_copy.pop('authorizations', None)
+        # The stored version is incremented by the backend instead.
+        account_copy.pop('authz_version', None)
+
+        result = await cls._update_account(account_copy)
+        cls.account_cache.invalidate(account_copy['email'])
+        return result
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def update_account_roles(cls, email: str, add_roles: list[str],
+                                   remove_roles: list[str]) -> dict:
+        """
+        Adds and removes roles on an account in one atomic write, so
+        concurrent updates do not overwrite each other. Accounts that do
+        not exist are created.
+
+        Parameters:
+            email: The email address of the account.
+            add_roles: The roles to add.
+            remove_roles: The roles to remove.
+
+        Returns:
+            The updated account data.
+        """
+        await cls.setup()
+
+        account_data = cls.__resolve(
+            await cls._update_account_roles(email, add_roles, remove_roles))
+        # Concurrent updates can finish in a different order than they were
+        # applied, so caching this post-image could keep an older one.
+        cls.account_cache.invalidate(email)
+
+        return account_data
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def update_roles_in_bulk(cls, updates: list[dict]) -> list[dict]:
+        """
+        Adds and removes roles on many accounts at once. Accounts that do
+        not exist are created.
+
+        Parameters:
+            updates: Dictionaries with 'email', 'add_roles' and 'remove_roles'.
+
+        Returns:
+            One result per update, with a 'status' of 'created', 'updated'
+            or 'error'.
+        """
+        await cls.setup()
+        if not updates:
+            return []
+
+        results = await cls._update_roles(updates)
+        for update in updates:
+            cls.account_cache.invalidate(update['email'])
+        return results
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def delete_account(cls, account: dict):
+        """
+        Deletes an account.
+
+        Parameters:
+            account: The account data.
+        """
+        await cls.setup()
+        result = await cls._delete_account(account['email'])
+        cls.account_cache.invalidate(account['email'])
+        return result
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def create_account(cls, account_data: dict):
+        """
+        Creates an account.
+
+        Parameters
+            account_data: The account data.
+        """
+        await cls.setup()
+        result = await cls._insert_account(account_data)
+        cls.account_cache.invalidate(account_data['email'])
+        return result
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def revoke_token(cls, jti: str, expires_at: float) -> bool:
+        """
+        Revokes a token ID. Recording an ID is atomic, so when two requests
+        revoke the same ID, only one of them succeeds.
+
+        Parameters:
+            jti: The token ID, or the ID of a family of refresh tokens.
+            expires_at: The time, in seconds since the epoch, after which
+                every token with the ID has expired and the record can go.
+
+        Returns:
+            Whether the ID was not already revoked.
+        """
+        await cls.setup()
+        return await cls._insert_revoked_token(jti, expires_at, time.time())
+
+    @classmethod
+    @timed(DB_LATENCY)
+    async def get_revoked_tokens(cls, since: float = 0, prefix: str = '') -> list[dict]:
+        """
+        Finds the token IDs that were revoked at or after a time and have
+        not expired.
+
+        Parameters:
+            since: The time, in seconds since the epoch.
+            prefix: Only IDs that start with this prefix are returned.
+
+        Returns:
+            Dictionaries with 'jti', 'expires_at' and 'revoked_at'.
+        """
+        await cls.setup()
+        return await cls._find_revoked_tokens(since, prefix)